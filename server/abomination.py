@@ -1,12 +1,24 @@
 from __future__ import annotations
-import math
+import copy
 import random
+import heapq
 from collections import deque
-from dataclasses import dataclass, field
+from dataclasses import dataclass, fields
 from typing import Literal, Optional, TypeAlias
 
 import numpy as np
 
+from . import events as ev
+from .assignment import linear_sum_assignment
+from .dist_cache import DIST_CACHE, get_dist_table, grid_fingerprint
+from .dist_table import bfs_distances
+from .mapf_utils import get_grid
+from .pibt_stack import funcPIBT_stack
+from .profiler import NULL_PROFILER, PhaseProfiler
+from .snapshot import SnapshotReader, SnapshotWriter
+from .staging import StagingAllocator
+from .station_index import StationIndex
+
 Grid: TypeAlias = np.ndarray
 Coord: TypeAlias = tuple[int, int]
 Config: TypeAlias = list[Coord]
@@ -16,31 +28,15 @@ Configs: TypeAlias = list[Config]
 class DistTable:
     grid: Grid
     source: Coord
-    dist: np.ndarray = field(init=False)
+    dist: Optional[np.ndarray] = None  # computed unless given, e.g., a shared memory view
 
     def __post_init__(self):
-        h, w = self.grid.shape
-        d = np.full((h, w), np.iinfo(np.int32).max, dtype=np.int32)
-        sy, sx = self.source
-        if not self.grid[sy, sx]:
-            self.dist = d
-            return
-        qy = deque([sy])
-        qx = deque([sx])
-        d[sy, sx] = 0
-        while qy:
-            y = qy.popleft()
-            x = qx.popleft()
-            v = d[y, x] + 1
-            if y > 0 and self.grid[y - 1, x] and v < d[y - 1, x]:
-                d[y - 1, x] = v; qy.append(y - 1); qx.append(x)
-            if y + 1 < h and self.grid[y + 1, x] and v < d[y + 1, x]:
-                d[y + 1, x] = v; qy.append(y + 1); qx.append(x)
-            if x > 0 and self.grid[y, x - 1] and v < d[y, x - 1]:
-                d[y, x - 1] = v; qy.append(y); qx.append(x - 1)
-            if x + 1 < w and self.grid[y, x + 1] and v < d[y, x + 1]:
-                d[y, x + 1] = v; qy.append(y); qx.append(x + 1)
-        self.dist = d
+        if self.dist is None:
+            self.dist = bfs_distances(self.grid, self.source, np.iinfo(np.int32).max)
+
+    @property
+    def nbytes(self) -> int:
+        return self.dist.nbytes
 
     def get(self, u: Coord) -> int:
         return int(self.dist[u])
@@ -56,22 +52,42 @@ def get_neighbors(grid: Grid, u: Coord) -> list[Coord]:
     return out
 
 class PIBT:
-    def __init__(self, grid: Grid, starts: Config, goals: Config, seed: int = 0):
+    def __init__(self, grid: Grid, starts: Config, goals: Config, seed: int = 0, use_stack: bool = False, profiler=None):
         self.grid = grid
         self.starts = starts
-        self.goals = goals
+        self.goals = list(goals)
         self.N = len(self.starts)
-        self.dist_tables = [DistTable(grid, goal) for goal in goals]
+        self.grid_fp = grid_fingerprint(grid)
+        self.dist_tables = [get_dist_table(grid, goal, DistTable, self.grid_fp) for goal in goals]
         self.NIL = self.N
         self.NIL_COORD: Coord = self.grid.shape
         self.occupied_now = np.full(grid.shape, self.NIL, dtype=int)
         self.occupied_nxt = np.full(grid.shape, self.NIL, dtype=int)
         self.rng = np.random.default_rng(seed)
-
-    def funcPIBT(self, Q_from: Config, Q_to: Config, i: int) -> bool:
+        self.use_stack = use_stack
+        self.max_chain_depth = 0
+        self.prof = profiler if profiler is not None else NULL_PROFILER
+        self.calls = 0
+
+    def set_goal(self, i: int, goal: Coord):
+        # priorities are the caller's here, see Simulator.update_priorities
+        if goal == self.goals[i]: return
+        self.goals[i] = goal
+        self.dist_tables[i] = get_dist_table(self.grid, goal, DistTable, self.grid_fp)
+
+    def set_goals(self, mask: np.ndarray, goals: Config):
+        for i, goal in zip(np.flatnonzero(mask).tolist(), goals):
+            self.set_goal(i, goal)
+
+    def candidates(self, Q_from: Config, i: int) -> Config:
+        self.calls += 1
         C = [Q_from[i]] + get_neighbors(self.grid, Q_from[i])
         self.rng.shuffle(C)
-        C = sorted(C, key=lambda u: self.dist_tables[i].get(u))
+        return sorted(C, key=lambda u: self.dist_tables[i].get(u))
+
+    def funcPIBT(self, Q_from: Config, Q_to: Config, i: int, depth: int = 1) -> bool:
+        self.max_chain_depth = max(self.max_chain_depth, depth)
+        C = self.candidates(Q_from, i)
         for v in C:
             if self.occupied_nxt[v] != self.NIL:
                 continue
@@ -80,7 +96,7 @@ class PIBT:
                 continue
             Q_to[i] = v
             self.occupied_nxt[v] = i
-            if j != self.NIL and (Q_to[j] == self.NIL_COORD) and (not self.funcPIBT(Q_from, Q_to, j)):
+            if j != self.NIL and (Q_to[j] == self.NIL_COORD) and (not self.funcPIBT(Q_from, Q_to, j, depth + 1)):
                 continue
             return True
         Q_to[i] = Q_from[i]
@@ -88,18 +104,34 @@ class PIBT:
         return False
 
     def step(self, Q_from: Config, priorities: list[float]) -> Config:
+        m = self.prof.mark()
         N = len(Q_from)
         Q_to: Config = []
         for i, v in enumerate(Q_from):
             Q_to.append(self.NIL_COORD)
             self.occupied_now[v] = i
+        m = self.prof.lap('pibt.setup', m)
+        self.max_chain_depth = 0
+        self.calls = 0
+        top = 0
         A = sorted(list(range(N)), key=lambda i: priorities[i], reverse=True)
+        m = self.prof.lap('pibt.sort', m)
         for i in A:
-            if Q_to[i] == self.NIL_COORD:
+            if Q_to[i] != self.NIL_COORD:
+                continue
+            top += 1
+            if self.use_stack:
+                _, depth = funcPIBT_stack(self, Q_from, Q_to, i)
+                self.max_chain_depth = max(self.max_chain_depth, depth)
+            else:
                 self.funcPIBT(Q_from, Q_to, i)
+        m = self.prof.lap('pibt.plan', m)
         for q_from, q_to in zip(Q_from, Q_to):
             self.occupied_now[q_from] = self.NIL
             self.occupied_nxt[q_to] = self.NIL
+        self.prof.lap('pibt.cleanup', m)
+        self.prof.count('pibt.inheritance', self.calls - top)
+        self.prof.count('pibt.chain_depth', self.max_chain_depth)
         return Q_to
 
 class StationSet:
@@ -109,6 +141,58 @@ class StationSet:
         self.holder: list[Optional[int]] = [None] * len(self.cells)
         self.queue: list[deque[int]] = [deque() for _ in self.cells]
         self.in_queue: list[set[int]] = [set() for _ in self.cells]
+        self.free_index: Optional[StationIndex] = None
+        # lazy min-heap of (queue length, k), entries go stale when the queue
+        # changes and are skipped on lookup; stations whose holder became None
+        # or that got an agent queued while free, for dispatch
+        self.lengths: list[tuple[int, int]] = [(0, k) for k in range(len(self.cells))]
+        self.freed: set[int] = set()
+        self.queued = 0
+
+    def attach_index(self, grid: Grid):
+        self.free_index = StationIndex(grid, self.cells)
+        self.free_index.reset([h is None for h in self.holder])
+
+    def set_holder(self, k: int, agent: Optional[int]):
+        if self.free_index is not None:
+            if self.holder[k] is None and agent is not None:
+                self.free_index.claim(k)
+            elif self.holder[k] is not None and agent is None:
+                self.free_index.release(k)
+        if agent is None:
+            self.freed.add(k)
+        self.holder[k] = agent
+
+    def restore(self, holder: list[Optional[int]], queues: list[list[int]]):
+        self.holder = holder
+        self.queue = [deque(q) for q in queues]
+        self.in_queue = [set(q) for q in queues]
+        if self.free_index is not None:
+            self.free_index.reset([h is None for h in holder])
+        self.lengths = [(len(q), k) for k, q in enumerate(self.queue)]
+        heapq.heapify(self.lengths)
+        self.freed = set(range(len(self.cells)))
+        self.queued = sum(len(q) for q in self.queue)
+
+    def queue_changed(self, k: int):
+        heapq.heappush(self.lengths, (len(self.queue[k]), k))
+        if len(self.lengths) > 4 * len(self.cells) + 64:
+            self.lengths = [(len(q), j) for j, q in enumerate(self.queue)]
+            heapq.heapify(self.lengths)
+
+    def shortest_queue(self) -> int:
+        # same as min(range(K), key=len(queue[k])), lowest k on ties
+        while self.lengths[0][0] != len(self.queue[self.lengths[0][1]]):
+            heapq.heappop(self.lengths)
+        return self.lengths[0][1]
+
+    def take_freed(self) -> list[int]:
+        freed = sorted(self.freed)
+        self.freed.clear()
+        return freed
+
+    def nearest_free(self, pos: Coord) -> Optional[int]:
+        return self.free_index.nearest(pos)
 
     def is_taken(self, k: int) -> bool:
         return self.holder[k] is not None
@@ -119,7 +203,7 @@ class StationSet:
 
     def claim_if_free(self, k: int, agent: int) -> bool:
         if self.holder[k] is None:
-            self.holder[k] = agent
+            self.set_holder(k, agent)
             return True
         return False
 
@@ -127,32 +211,68 @@ class StationSet:
         if agent not in self.in_queue[k] and self.holder[k] != agent:
             self.queue[k].append(agent)
             self.in_queue[k].add(agent)
+            self.queued += 1
+            self.queue_changed(k)
+            if self.holder[k] is None:
+                self.freed.add(k)
 
     def pop_next(self, k: int) -> Optional[int]:
         if self.queue[k]:
             a = self.queue[k].popleft()
             self.in_queue[k].discard(a)
-            self.holder[k] = a
+            self.queued -= 1
+            self.queue_changed(k)
+            self.set_holder(k, a)
             return a
         return None
 
     def release_if_holder(self, k: int, agent: int):
         if self.holder[k] == agent:
-            self.holder[k] = None
+            self.set_holder(k, None)
 
     def holder_of(self, k: int) -> Optional[int]:
         return self.holder[k]
 
+MODES = ('to_load', 'at_load_wait', 'to_dump', 'to_charge', 'charging', 'staging', 'stay')
+TO_LOAD, AT_LOAD_WAIT, TO_DUMP, TO_CHARGE, CHARGING, STAGING, STAY_MODE = range(len(MODES))
+GOAL_KINDS = ('load', 'dump', 'charge', 'staging', 'stay')
+LOAD, DUMP, CHARGE, STAGE, STAY = range(len(GOAL_KINDS))
+STATION_KINDS = ('L', 'D', 'C')
+AT_L, AT_D, AT_C = range(len(STATION_KINDS))
+NO_CLAIM = -1
+# station kind an agent in each mode is heading to, -2 when none
+ARRIVE_KIND = np.array([AT_L, -2, AT_D, AT_C, -2, -2, -2], dtype=np.int8)
+# mode, goal kind and goal event of an agent sent to a loader / dump
+HEAD_TO = {'L': (TO_LOAD, 'load', ev.GOAL_LOADER), 'D': (TO_DUMP, 'dump', ev.GOAL_DUMP)}
+
 @dataclass
-class AgentState:
-    goal_kind: Literal['load', 'dump', 'charge', 'staging', 'stay']
-    goal: Coord
-    battery: int
-    dwell_steps: int = 0
-    staging: Optional[Coord] = None
-    claim: Optional[tuple[Literal['L', 'D', 'C'], int]] = None
-    queued: Optional[tuple[Literal['L', 'D', 'C'], int]] = None
-    mode: Literal['to_load', 'at_load_wait', 'to_dump', 'to_charge', 'charging', 'staging', 'stay'] = 'to_load'
+class AgentStates:
+    # struct of arrays, entry i belongs to agent i
+    mode: np.ndarray  # int8, index into MODES
+    goal_kind: np.ndarray  # int8, index into GOAL_KINDS
+    goal: np.ndarray  # flat cell id
+    battery: np.ndarray
+    dwell_steps: np.ndarray
+    claim_kind: np.ndarray  # int8, index into STATION_KINDS or NO_CLAIM
+    claim_station: np.ndarray
+    claim_cell: np.ndarray  # flat cell id of the claimed station, -1 if none
+
+    @classmethod
+    def create(cls, N: int, battery: int) -> AgentStates:
+        return cls(
+            mode=np.full(N, TO_LOAD, dtype=np.int8),
+            goal_kind=np.full(N, STAY, dtype=np.int8),
+            goal=np.zeros(N, dtype=np.int64),
+            battery=np.full(N, battery, dtype=np.int64),
+            dwell_steps=np.zeros(N, dtype=np.int64),
+            claim_kind=np.full(N, NO_CLAIM, dtype=np.int8),
+            claim_station=np.full(N, -1, dtype=np.int64),
+            claim_cell=np.full(N, -1, dtype=np.int64),
+        )
+
+    def claim(self, i: int) -> Optional[tuple[Literal['L', 'D', 'C'], int]]:
+        if self.claim_kind[i] == NO_CLAIM: return None
+        return STATION_KINDS[self.claim_kind[i]], int(self.claim_station[i])
 
 class Simulator:
     def __init__(
@@ -168,7 +288,12 @@ class Simulator:
         charge_rate: int = 100,
         dwell_min_steps: int = 10,
         dwell_max_steps: int = 30,
-        resume_policy: Literal['full', 'threshold'] = 'full'
+        resume_policy: Literal['full', 'threshold'] = 'full',
+        events: Optional[ev.EventRing] = None,
+        assignment: Literal['greedy', 'batched'] = 'greedy',
+        batch_min: int = 4,
+        queue_penalty: Optional[float] = None,
+        profile: bool = False
     ):
         self.grid = grid.astype(bool)
         self.N = len(starts)
@@ -176,7 +301,8 @@ class Simulator:
         self.L = StationSet(loaders)
         self.D = StationSet(dumps)
         self.C = StationSet(chargers)
-        self.priorities: list[float] = [0.0] * self.N
+        self.L.attach_index(self.grid)
+        self.C.attach_index(self.grid)
         self.rng = np.random.default_rng(seed)
         self.py_rng = random.Random(seed)
         self.battery_max = battery_max
@@ -185,47 +311,42 @@ class Simulator:
         self.dwell_min_steps = dwell_min_steps
         self.dwell_max_steps = dwell_max_steps
         self.resume_policy = resume_policy
-        self.dist_cache: dict[Coord, DistTable] = {}
+        self.events = events if events is not None else ev.EventRing()
+        self.assignment = assignment
+        self.batch_min = batch_min
+        self.queue_penalty = queue_penalty if queue_penalty is not None else (dwell_min_steps + dwell_max_steps) / 2
+        self.pending: dict[str, list[int]] = {'L': [], 'D': []}
+        self.grid_fp = grid_fingerprint(self.grid)
         for c in loaders + dumps + chargers:
-            self.dist_cache[c] = DistTable(self.grid, c)
-        self.states: list[AgentState] = []
-        for i, s in enumerate(starts):
-            gk, g, claim = self.choose_loader_target(i, s)
-            self.states.append(AgentState(goal_kind=gk, goal=g, battery=battery_max, claim=claim, mode='to_load'))
-        self.pibt = PIBT(self.grid, self.Q, [st.goal for st in self.states], seed=seed)
-        for i in range(self.N):
-            self.priorities[i] = self.dist_to(self.states[i].goal, self.Q[i]) / self.grid.size
+            self.dist_table(c)
         self.staging_reserved: set[Coord] = set()
+        self.staging = StagingAllocator(self.grid, loaders + dumps + chargers)
+        self.staging.set_positions(None, self.config_ids(self.Q))
         self.t = 0
+        self.pos = self.config_ids(self.Q)
+        self.agents = AgentStates.create(self.N, battery_max)
+        if assignment == 'batched':
+            self.pending['L'] = list(range(self.N))
+            self.assign_pending(announce=False)
+        else:
+            for i, s in enumerate(starts):
+                self.assign(i, *self.choose_loader_target(i, s))
+        self.prof = PhaseProfiler() if profile else NULL_PROFILER
+        self.pibt = PIBT(self.grid, self.Q, self.goals(), seed=seed, profiler=self.prof)
+        self.pibt_goal_ids = self.config_ids(self.pibt.goals)
+        self.priorities = np.array([self.dist_to(g, q) / self.grid.size for g, q in zip(self.goals(), self.Q)])
+
+    def dist_table(self, target: Coord) -> DistTable:
+        return get_dist_table(self.grid, target, DistTable, self.grid_fp)
 
     def dist_to(self, target: Coord, pos: Coord) -> int:
-        dt = self.dist_cache.get(target)
-        if dt is None:
-            dt = DistTable(self.grid, target)
-            self.dist_cache[target] = dt
-        return dt.get(pos)
+        return self.dist_table(target).get(pos)
 
     def nearest_unclaimed_loader(self, i: int, pos: Coord) -> Optional[int]:
-        best = None
-        bestd = math.inf
-        for k, c in enumerate(self.L.cells):
-            if not self.L.is_taken(k):
-                d = self.dist_to(c, pos)
-                if d < bestd:
-                    bestd = d
-                    best = k
-        return best
+        return self.L.nearest_free(pos)
 
     def nearest_unclaimed_charger(self, i: int, pos: Coord) -> Optional[int]:
-        best = None
-        bestd = math.inf
-        for k, c in enumerate(self.C.cells):
-            if not self.C.is_taken(k):
-                d = self.dist_to(c, pos)
-                if d < bestd:
-                    bestd = d
-                    best = k
-        return best
+        return self.C.nearest_free(pos)
 
     def random_dump_index(self) -> int:
         return self.py_rng.randrange(len(self.D.cells))
@@ -234,12 +355,10 @@ class Simulator:
         k = self.nearest_unclaimed_loader(i, pos)
         if k is not None and self.L.claim_if_free(k, i):
             return 'load', self.L.cells[k], ('L', k)
-        qlens = [(len(self.L.queue[k]), k) for k in range(len(self.L.cells))]
-        qlens.sort()
-        k = qlens[0][1]
+        k = self.L.shortest_queue()
         self.L.enqueue(k, i)
         sc = self.find_staging_cell_near(self.L.cells[k])
-        self.staging_reserved.add(sc)
+        self.reserve_staging(sc)
         return 'staging', sc, None
 
     def choose_dump_target(self, i: int, pos: Coord) -> tuple[Literal['dump', 'staging'], Coord, Optional[tuple[Literal['D'], int]]]:
@@ -248,204 +367,337 @@ class Simulator:
         for k in idxs:
             if not self.D.is_taken(k) and self.D.claim_if_free(k, i):
                 return 'dump', self.D.cells[k], ('D', k)
-        k = min(range(len(self.D.cells)), key=lambda j: len(self.D.queue[j]))
+        k = self.D.shortest_queue()
         self.D.enqueue(k, i)
         sc = self.find_staging_cell_near(self.D.cells[k])
-        self.staging_reserved.add(sc)
+        self.reserve_staging(sc)
         return 'staging', sc, None
 
     def choose_charger_target(self, i: int, pos: Coord) -> tuple[Literal['charge', 'staging'], Coord, Optional[tuple[Literal['C'], int]]]:
         k = self.nearest_unclaimed_charger(i, pos)
         if k is not None and self.C.claim_if_free(k, i):
             return 'charge', self.C.cells[k], ('C', k)
-        k = min(range(len(self.C.cells)), key=lambda j: len(self.C.queue[j]))
+        k = self.C.shortest_queue()
         self.C.enqueue(k, i)
         sc = self.find_staging_cell_near(self.C.cells[k])
-        self.staging_reserved.add(sc)
+        self.reserve_staging(sc)
         return 'staging', sc, None
 
+    def config_ids(self, Q: Config) -> np.ndarray:
+        w = self.grid.shape[1]
+        return np.array([y * w + x for (y, x) in Q], dtype=np.int64)
+
+    def reserve_staging(self, sc: Coord):
+        self.staging_reserved.add(sc)
+        self.staging.reserve(sc)
+
     def find_staging_cell_near(self, target: Coord) -> Coord:
-        h, w = self.grid.shape
-        occupied = set(self.Q)
-        reserved = occupied | self.staging_reserved | set(self.L.cells) | set(self.D.cells) | set(self.C.cells)
-        sy, sx = target
-        if self.grid[sy, sx] and (sy, sx) not in reserved:
-            return (sy, sx)
-        d = np.full((h, w), -1, dtype=np.int32)
-        qy = deque()
-        qx = deque()
-        qy.append(sy); qx.append(sx); d[sy, sx] = 0
-        while qy:
-            y = qy.popleft(); x = qx.popleft()
-            if self.grid[y, x] and (y, x) not in reserved:
-                return (y, x)
-            if y > 0 and d[y - 1, x] == -1:
-                d[y - 1, x] = d[y, x] + 1; qy.append(y - 1); qx.append(x)
-            if y + 1 < h and d[y + 1, x] == -1:
-                d[y + 1, x] = d[y, x] + 1; qy.append(y + 1); qx.append(x)
-            if x > 0 and d[y, x - 1] == -1:
-                d[y, x - 1] = d[y, x] + 1; qy.append(y); qx.append(x - 1)
-            if x + 1 < w and d[y, x + 1] == -1:
-                d[y, x + 1] = d[y, x] + 1; qy.append(y); qx.append(x + 1)
-        return self.Q[0]
-
-    def goals_for_pibt(self) -> Config:
-        out: Config = []
-        for i, st in enumerate(self.states):
-            if st.goal_kind == 'stay':
-                out.append(self.Q[i])
-            else:
-                out.append(st.goal)
-        return out
+        # nearest passable cell that is no station, not occupied and not reserved
+        sc = self.staging.find_near(target)
+        return sc if sc is not None else self.Q[0]
 
-    def update_priorities(self, Q_next: Config):
-        for i, (q, g) in enumerate(zip(Q_next, [st.goal for st in self.states])):
-            if q != g:
-                self.priorities[i] += 1
-            else:
-                self.priorities[i] -= math.floor(self.priorities[i])
+    def coords(self, ids: np.ndarray) -> Config:
+        ys, xs = np.divmod(ids, self.grid.shape[1])
+        return list(zip(ys.tolist(), xs.tolist()))
 
-    def step(self) -> dict:
-        events: list[dict] = []
-        for i, st in enumerate(self.states):
-            pos = self.Q[i]
-            if st.mode == 'to_load' and st.claim and st.claim[0] == 'L':
-                k = st.claim[1]
-                if pos == self.L.cells[k]:
-                    st.mode = 'at_load_wait'
-                    st.goal_kind = 'stay'
-                    st.goal = pos
-                    st.dwell_steps = self.py_rng.randint(self.dwell_min_steps, self.dwell_max_steps)
-                    events.append({'type': 'arrived_loader', 'agent': i, 'at': pos, 'dwell_steps': st.dwell_steps})
-            if st.mode == 'to_dump' and st.claim and st.claim[0] == 'D':
-                k = st.claim[1]
-                if pos == self.D.cells[k]:
-                    self.D.release_if_holder(k, i)
-                    st.claim = None
-                    events.append({'type': 'arrived_dump', 'agent': i, 'at': pos})
-                    if st.battery <= self.battery_low:
-                        st.mode = 'to_charge'
-                        kind, g, claim = self.choose_charger_target(i, pos)
-                        st.goal_kind = kind
-                        st.goal = g
-                        st.claim = claim
-                        if kind == 'staging': st.mode = 'staging'
-                        events.append({'type': 'goal_charge', 'agent': i, 'goal': st.goal})
-                    else:
-                        st.mode = 'to_load'
-                        kind, g, claim = self.choose_loader_target(i, pos)
-                        st.goal_kind = kind
-                        st.goal = g
-                        st.claim = claim
-                        if kind == 'staging': st.mode = 'staging'
-                        events.append({'type': 'goal_loader', 'agent': i, 'goal': st.goal})
-            if st.mode == 'to_charge' and st.claim and st.claim[0] == 'C':
-                k = st.claim[1]
-                if pos == self.C.cells[k]:
-                    st.mode = 'charging'
-                    st.goal_kind = 'charge'
-                    st.goal = self.C.cells[k]
-                    events.append({'type': 'arrived_charger', 'agent': i, 'at': pos})
-            if st.mode == 'staging':
-                st.goal_kind = 'staging'
-        for i, st in enumerate(self.states):
-            if st.mode == 'at_load_wait':
-                if st.dwell_steps > 0:
-                    st.dwell_steps -= 1
-                    if st.dwell_steps == 0:
-                        if st.claim and st.claim[0] == 'L':
-                            self.L.release_if_holder(st.claim[1], i)
-                            st.claim = None
-                        st.mode = 'to_dump'
-                        kind, g, claim = self.choose_dump_target(i, self.Q[i])
-                        st.goal_kind = kind
-                        st.goal = g
-                        st.claim = claim
-                        if kind == 'staging': st.mode = 'staging'
-                        events.append({'type': 'dwell_finished', 'agent': i})
-                        events.append({'type': 'goal_dump', 'agent': i, 'goal': st.goal})
-            if st.mode == 'charging':
-                st.battery = min(self.battery_max, st.battery + self.charge_rate)
-                events.append({'type': 'battery', 'agent': i, 'value': st.battery})
-                resume = False
-                if self.resume_policy == 'full':
-                    resume = st.battery >= self.battery_max
-                else:
-                    resume = st.battery >= max(self.battery_low + 200, self.charge_rate * 3)
-                if resume:
-                    if st.claim and st.claim[0] == 'C':
-                        self.C.release_if_holder(st.claim[1], i)
-                        st.claim = None
-                    st.mode = 'to_load'
-                    kind, g, claim = self.choose_loader_target(i, self.Q[i])
-                    st.goal_kind = kind
-                    st.goal = g
-                    st.claim = claim
-                    if kind == 'staging': st.mode = 'staging'
-                    events.append({'type': 'leave_charger', 'agent': i})
-                    events.append({'type': 'goal_loader', 'agent': i, 'goal': st.goal})
-        for k in range(len(self.L.cells)):
-            if self.L.holder_of(k) is None and self.L.queue[k]:
-                a = self.L.pop_next(k)
-                if a is not None:
-                    if self.states[a].mode == 'staging':
-                        self.states[a].mode = 'to_load'
-                    self.states[a].goal_kind = 'load'
-                    self.states[a].goal = self.L.cells[k]
-                    self.states[a].claim = ('L', k)
-                    events.append({'type': 'loader_claimed', 'agent': a, 'station': self.L.cells[k]})
-        for k in range(len(self.D.cells)):
-            if self.D.holder_of(k) is None and self.D.queue[k]:
-                a = self.D.pop_next(k)
-                if a is not None:
-                    if self.states[a].mode == 'staging':
-                        self.states[a].mode = 'to_dump'
-                    self.states[a].goal_kind = 'dump'
-                    self.states[a].goal = self.D.cells[k]
-                    self.states[a].claim = ('D', k)
-                    events.append({'type': 'dump_claimed', 'agent': a, 'station': self.D.cells[k]})
-        for k in range(len(self.C.cells)):
-            if self.C.holder_of(k) is None and self.C.queue[k]:
-                a = self.C.pop_next(k)
-                if a is not None:
-                    if self.states[a].mode == 'staging':
-                        self.states[a].mode = 'to_charge'
-                    self.states[a].goal_kind = 'charge'
-                    self.states[a].goal = self.C.cells[k]
-                    self.states[a].claim = ('C', k)
-                    events.append({'type': 'charger_claimed', 'agent': a, 'station': self.C.cells[k]})
-        goals = self.goals_for_pibt()
-        self.pibt.goals = goals
-        self.pibt.dist_tables = [DistTable(self.grid, g) for g in goals]
-        Q_next = self.pibt.step(self.Q, self.priorities)
-        moved = [a != b for a, b in zip(self.Q, Q_next)]
-        for i, mv in enumerate(moved):
-            if mv:
-                self.states[i].battery = max(0, self.states[i].battery - 1)
-        self.update_priorities(Q_next)
+    def goals(self) -> Config:
+        return self.coords(self.agents.goal)
+
+    def station_set(self, kind: Literal['L', 'D', 'C']) -> StationSet:
+        return {'L': self.L, 'D': self.D, 'C': self.C}[kind]
+
+    def set_claim(self, i: int, claim: Optional[tuple[Literal['L', 'D', 'C'], int]]):
+        a = self.agents
+        if claim is None:
+            a.claim_kind[i] = NO_CLAIM; a.claim_station[i] = -1; a.claim_cell[i] = -1
+            return
+        kind, k = claim
+        y, x = self.station_set(kind).cells[k]
+        a.claim_kind[i] = STATION_KINDS.index(kind); a.claim_station[i] = k; a.claim_cell[i] = y * self.grid.shape[1] + x
+
+    def assign(self, i: int, kind: str, g: Coord, claim: Optional[tuple[Literal['L', 'D', 'C'], int]]):
+        self.agents.goal_kind[i] = GOAL_KINDS.index(kind)
+        self.agents.goal[i] = g[0] * self.grid.shape[1] + g[1]
+        self.set_claim(i, claim)
+
+    def retarget(self, i: int, mode: int, choose, pos: Coord) -> Coord:
+        kind, g, claim = choose(i, pos)
+        self.assign(i, kind, g, claim)
+        self.agents.mode[i] = STAGING if kind == 'staging' else mode
+        return g
+
+    def goal_ids(self) -> np.ndarray:
+        a = self.agents
+        return np.where(a.goal_kind == STAY, self.pos, a.goal)
+
+    def update_pibt_goals(self):
+        # only agents whose goal changed since the last tick get a new table
+        goals = self.goal_ids()
+        changed = goals != self.pibt_goal_ids
+        self.pibt.set_goals(changed, self.coords(goals[changed]))
+        self.pibt_goal_ids = goals
+        self.prof.count('goals_changed', int(np.count_nonzero(changed)))
+
+    def update_priorities(self, pos_next: np.ndarray):
+        reached = pos_next == self.agents.goal
+        self.priorities[~reached] += 1
+        self.priorities[reached] -= np.floor(self.priorities[reached])
+
+    def arrive(self, i: int):
+        a = self.agents
+        pos = self.Q[i]
+        if a.mode[i] == TO_LOAD and a.claim_kind[i] == AT_L and a.claim_cell[i] == self.pos[i]:
+            a.mode[i] = AT_LOAD_WAIT
+            a.goal_kind[i] = STAY
+            a.goal[i] = self.pos[i]
+            a.dwell_steps[i] = self.py_rng.randint(self.dwell_min_steps, self.dwell_max_steps)
+            self.emit(ev.ARRIVED_LOADER, i, self.pos[i], a.dwell_steps[i])
+        if a.mode[i] == TO_DUMP and a.claim_kind[i] == AT_D and a.claim_cell[i] == self.pos[i]:
+            self.D.release_if_holder(int(a.claim_station[i]), i)
+            self.set_claim(i, None)
+            self.emit(ev.ARRIVED_DUMP, i, self.pos[i])
+            if a.battery[i] <= self.battery_low:
+                self.retarget(i, TO_CHARGE, self.choose_charger_target, pos)
+                self.emit(ev.GOAL_CHARGE, i, a.goal[i])
+            else:
+                self.head_to(i, 'L', pos)
+        if a.mode[i] == TO_CHARGE and a.claim_kind[i] == AT_C and a.claim_cell[i] == self.pos[i]:
+            a.mode[i] = CHARGING
+            a.goal_kind[i] = CHARGE
+            a.goal[i] = a.claim_cell[i]
+            self.emit(ev.ARRIVED_CHARGER, i, self.pos[i])
+
+    def head_to(self, i: int, kind: Literal['L', 'D'], pos: Coord):
+        # loader / dump requests wait for the batch of this tick in batched mode
+        if self.assignment == 'batched':
+            self.pending[kind].append(i)
+        else:
+            self.head_to_greedy(i, kind, pos)
+
+    def head_to_greedy(self, i: int, kind: Literal['L', 'D'], pos: Coord):
+        mode, _, event = HEAD_TO[kind]
+        self.retarget(i, mode, self.choose_loader_target if kind == 'L' else self.choose_dump_target, pos)
+        self.emit(event, i, self.agents.goal[i])
+
+    def assign_pending(self, announce: bool = True):
+        for kind in ('L', 'D'):
+            agents, self.pending[kind] = self.pending[kind], []
+            if len(agents) >= self.batch_min:
+                self.assign_batch(kind, agents, announce)
+                continue
+            for i in agents:  # tiny batch, one agent at a time on the same costs
+                self.assign_batch(kind, [i], announce)
+
+    def assign_batch(self, kind: Literal['L', 'D'], agents: list[int], announce: bool = True):
+        # min-cost matching of agents to (queue slot, station) columns; the cost
+        # is when the agent could start at the station: its travel time, or
+        # when the holder and the agents queued ahead are done if that is later
+        a = self.agents
+        S = self.station_set(kind)
+        mode, goal_kind, event = HEAD_TO[kind]
+        service = self.queue_penalty if kind == 'L' else 1.0
+        n, K = len(agents), len(S.cells)
+        fields = [self.dist_table(c).dist.reshape(-1) for c in S.cells]
+        dist = np.stack([f[self.pos[agents]] for f in fields], axis=1).astype(np.float64)
+        ready = np.zeros(K)
+        for k in range(K):
+            h = S.holder_of(k)
+            if h is not None:
+                ready[k] = a.dwell_steps[h] if a.mode[h] == AT_LOAD_WAIT else fields[k][self.pos[h]] + service
+            ready[k] += len(S.queue[k]) * service
+        direct = np.array([not S.is_taken(k) and len(S.queue[k]) == 0 for k in range(K)])
+        slots = np.arange(-(-n // K) + 1)
+        start = ready[None, :] + service * (slots[:, None] - direct[None, :] + 1)
+        start[0, direct] = 0
+        # among equal start times the closer agent goes first, and later slots
+        # of a station only win when strictly better
+        cost = np.maximum(dist[:, None, :], start[None, :, :]) + 0.1 * dist[:, None, :] + 1e-3 * slots[None, :, None]
+        if n == 1:
+            rows, cols = np.zeros(1, dtype=np.int64), np.argmin(cost.reshape(1, -1), axis=1)
+        else:
+            rows, cols = linear_sum_assignment(cost.reshape(n, -1))
+        slot, station = np.divmod(cols, K)
+
+        # direct claims first, then queues in slot order
+        for r in np.lexsort((rows, slot)).tolist():
+            i, k = agents[rows[r]], int(station[r])
+            if slot[r] == 0 and direct[k] and S.claim_if_free(k, i):
+                self.assign(i, goal_kind, S.cells[k], (kind, k))
+                a.mode[i] = mode
+            else:
+                S.enqueue(k, i)
+                sc = self.find_staging_cell_near(S.cells[k])
+                self.reserve_staging(sc)
+                self.assign(i, 'staging', sc, None)
+                a.mode[i] = STAGING
+            if announce:
+                self.emit(event, i, a.goal[i])
+
+    def emit(self, code: int, i: int, cell: int = -1, value: int = 0):
+        # stamped with the timestep the running tick produces
+        self.events.push(self.t + 1, code, i, cell, value)
+
+    def tick(self):
+        a = self.agents
+        start = m = self.prof.mark()
+        searches, built = self.staging.searches, DIST_CACHE.misses
+
+        # arrivals, only agents standing on the station they claimed
+        arrived = (ARRIVE_KIND[a.mode] == a.claim_kind) & (a.claim_cell == self.pos)
+        for i in np.flatnonzero(arrived).tolist():
+            self.arrive(i)
+        a.goal_kind[a.mode == STAGING] = STAGE
+        m = self.prof.lap('arrivals', m)
+
+        # dwell and charge counters, then transitions of the agents they finished
+        waiting = (a.mode == AT_LOAD_WAIT) & (a.dwell_steps > 0)
+        a.dwell_steps[waiting] -= 1
+        dwelled = waiting & (a.dwell_steps == 0)
+        charging = a.mode == CHARGING
+        a.battery[charging] = np.minimum(self.battery_max, a.battery[charging] + self.charge_rate)
+        if self.resume_policy == 'full':
+            charged = charging & (a.battery >= self.battery_max)
+        else:
+            charged = charging & (a.battery >= max(self.battery_low + 200, self.charge_rate * 3))
+        for i in np.flatnonzero(dwelled | charging).tolist():
+            if dwelled[i]:
+                if a.claim_kind[i] == AT_L:
+                    self.L.release_if_holder(int(a.claim_station[i]), i)
+                    self.set_claim(i, None)
+                self.emit(ev.DWELL_FINISHED, i)
+                self.head_to(i, 'D', self.Q[i])
+                continue
+            self.emit(ev.BATTERY, i, -1, a.battery[i])
+            if charged[i]:
+                if a.claim_kind[i] == AT_C:
+                    self.C.release_if_holder(int(a.claim_station[i]), i)
+                    self.set_claim(i, None)
+                self.emit(ev.LEAVE_CHARGER, i)
+                self.head_to(i, 'L', self.Q[i])
+        m = self.prof.lap('transitions', m)
+        self.assign_pending()
+        m = self.prof.lap('assignment', m)
+
+        # freed stations go to the next queued agent
+        for S, code, mode, kind, event in (
+            (self.L, 'L', TO_LOAD, 'load', ev.LOADER_CLAIMED),
+            (self.D, 'D', TO_DUMP, 'dump', ev.DUMP_CLAIMED),
+            (self.C, 'C', TO_CHARGE, 'charge', ev.CHARGER_CLAIMED),
+        ):
+            for k in S.take_freed():
+                if S.holder_of(k) is None and S.queue[k]:
+                    j = S.pop_next(k)
+                    if j is not None:
+                        if a.mode[j] == STAGING:
+                            a.mode[j] = mode
+                        self.assign(j, kind, S.cells[k], (code, k))
+                        self.emit(event, j, a.goal[j])
+        m = self.prof.lap('queues', m)
+
+        self.update_pibt_goals()
+        m = self.prof.lap('goals', m)
+        Q_next = self.pibt.step(self.Q, self.priorities.tolist())
+        m = self.prof.lap('pibt', m)
+        pos_next = self.config_ids(Q_next)
+        moved = self.pos != pos_next
+        a.battery[moved] = np.maximum(0, a.battery[moved] - 1)
+        self.update_priorities(pos_next)
+        self.staging.set_positions(self.pos, pos_next)
         self.Q = Q_next
+        self.pos = pos_next
         self.t += 1
-        return {'t': self.t, 'Q': self.Q, 'events': events, 'goals': goals, 'battery': [st.battery for st in self.states]}
+        self.prof.lap('update', m)
+        if self.prof.enabled:
+            self.prof.count('staging_searches', self.staging.searches - searches)
+            self.prof.count('dist_tables_built', DIST_CACHE.misses - built)
+        self.prof.tick(start)
+
+    def advance(self, K: int) -> int:
+        # headless, events only go to the ring
+        for _ in range(K):
+            self.tick()
+        return self.t
+
+    def step(self) -> dict:
+        # debug / per-tick output, consumes the event ring
+        self.tick()
+        events = ev.to_dicts(self.events.pull(), self.grid.shape[1])
+        return {'t': self.t, 'Q': self.Q, 'events': events, 'goals': list(self.pibt.goals), 'battery': self.agents.battery.tolist()}
+
+    def snapshot(self) -> bytes:
+        # mutable state only; grid, stations, distance tables and policy
+        # settings come from the simulator it is restored into
+        w = SnapshotWriter(self.t, self.N, len(self.L.cells), len(self.D.cells), len(self.C.cells))
+        w.array(self.pos, '<i8')
+        w.array(self.priorities, '<f8')
+        for f in fields(self.agents):
+            a = getattr(self.agents, f.name)
+            w.array(a, a.dtype)
+        for S in (self.L, self.D, self.C):
+            w.array([-1 if h is None else h for h in S.holder], '<i8')
+            w.array([len(q) for q in S.queue], '<i8')
+            w.array([j for q in S.queue for j in q], '<i8')
+        w.array(sorted(self.config_ids(list(self.staging_reserved)).tolist()), '<i8')
+        w.rng(self.rng)
+        w.rng(self.pibt.rng)
+        w.random(self.py_rng)
+        return w.getvalue()
+
+    def restore(self, data: bytes):
+        r = SnapshotReader(data)
+        if [r.N] + r.counts != [self.N, len(self.L.cells), len(self.D.cells), len(self.C.cells)]:
+            raise ValueError('snapshot of a different fleet or station layout')
+        self.t = r.t
+        self.pos = r.array('<i8')
+        self.Q = self.coords(self.pos)
+        self.priorities = r.array('<f8')
+        agents = AgentStates.create(self.N, 0)
+        for f in fields(agents):
+            setattr(agents, f.name, r.array(getattr(agents, f.name).dtype))
+        self.agents = agents
+        for S in (self.L, self.D, self.C):
+            holder = [None if h < 0 else h for h in r.array('<i8').tolist()]
+            lengths = r.array('<i8')
+            flat = r.array('<i8').tolist()
+            ends = np.cumsum(lengths).tolist()
+            S.restore(holder, [flat[e - n : e] for n, e in zip(lengths.tolist(), ends)])
+        reserved = r.array('<i8')
+        self.staging_reserved = set(self.coords(reserved))
+        self.staging.reset(self.pos, reserved)
+        r.rng(self.rng)
+        r.rng(self.pibt.rng)
+        r.random(self.py_rng)
+        self.pending = {'L': [], 'D': []}
+        self.pibt_goal_ids = np.full(self.N, -1, dtype=np.int64)  # all set on the next tick
+
+    def fork(self, snapshot: Optional[bytes] = None, events: Optional[ev.EventRing] = None, **params) -> Simulator:
+        # what-if branch from snapshot (default: now), sharing the grid, distance
+        # tables, staging search orders and PIBT scratch arrays; params override
+        # policy settings such as assignment or resume_policy
+        sim = copy.copy(self)
+        for k, v in params.items():
+            if not hasattr(self, k):
+                raise AttributeError(f'Simulator has no setting {k}')
+            setattr(sim, k, v)
+        sim.L, sim.D, sim.C = (copy.copy(S) for S in (self.L, self.D, self.C))
+        for S in (sim.L, sim.C):
+            S.free_index = copy.copy(S.free_index)
+        sim.staging = copy.copy(self.staging)
+        sim.staging.occupied = np.zeros_like(self.staging.occupied)
+        sim.staging.reserved = np.zeros_like(self.staging.reserved)
+        sim.pibt = copy.copy(self.pibt)
+        sim.pibt.goals = list(self.pibt.goals)
+        sim.pibt.dist_tables = list(self.pibt.dist_tables)
+        sim.pibt.rng = np.random.default_rng()
+        sim.prof = sim.pibt.prof = PhaseProfiler() if self.prof.enabled else NULL_PROFILER
+        sim.rng = np.random.default_rng()
+        sim.py_rng = random.Random()
+        sim.events = events if events is not None else ev.EventRing()
+        sim.restore(snapshot if snapshot is not None else self.snapshot())
+        return sim
 
 def load_movingai_map(path: str) -> Grid:
-    with open(path, 'r', encoding='utf-8') as f:
-        lines = [ln.rstrip('\n') for ln in f]
-    idx = 0
-    while idx < len(lines) and not lines[idx].lower().startswith('type'):
-        idx += 1
-    while idx < len(lines) and not lines[idx].lower().startswith('height'):
-        idx += 1
-    h = int(lines[idx].split()[-1]); idx += 1
-    w = int(lines[idx].split()[-1]); idx += 1
-    while idx < len(lines) and not lines[idx].lower().startswith('map'):
-        idx += 1
-    idx += 1
-    grid = np.zeros((h, w), dtype=bool)
-    for y in range(h):
-        row = lines[idx + y]
-        for x, ch in enumerate(row):
-            grid[y, x] = ch in ('.', 'G', 'S', 'T', ' ')
-    return grid
+    return get_grid(path)
 
 if __name__ == '__main__':
     h, w = 14, 20
@@ -1,98 +1,135 @@
 # server/app.py
 from __future__ import annotations
-import contextlib
-from pathlib import Path
 from contextlib import asynccontextmanager
-import asyncio
 import socketio
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 
-from server.destination_bin import DestinationBin
-from server.hivemind import Hivemind
-from server.robot import Robot, Orientation, GridPose, Position
-from server.map_reader import Grid, get_grid
+from server.sessions import SessionConfig, SessionManager
+from server.state_stream import FORMATS
 
-def create_app():
+DEFAULT_SESSION = "default"
+
+def payload_id(data):
+    # the "id" of an event payload, None if there is no such payload or id
+    session_id = data.get("id") if isinstance(data, dict) else None
+    return session_id if isinstance(session_id, str) else None
+
+def create_app(sim_dt: float = 0.01, broadcast_dt: float = 0.01, workers: int = 0, sim_process: bool = False):
+    # many independent sessions, see SessionManager; a "default" one with the
+    # sorter demo is created at startup and is what clients join unless they
+    # name another. each session steps every sim_dt of wall time whatever the
+    # broadcast does, frames go out every broadcast_dt. workers is the number
+    # of worker processes sessions can be pinned to; with sim_process the
+    # default session runs in worker 0, so that planning and physics never
+    # hold up socket I/O
     sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins=["http://localhost:3000"])
     app = FastAPI()
+    manager = SessionManager(sio, workers=max(workers, 1) if sim_process else workers)
+
+    async def new_session(data: dict) -> dict:
+        data = dict(data)
+        session_id = data.pop("id", None)
+        if session_id is not None and not isinstance(session_id, str):
+            raise ValueError("a session id is a string")
+        settings = {"sim_dt": sim_dt, "broadcast_dt": broadcast_dt, **data}
+        session = await manager.create(SessionConfig.from_dict(settings), session_id)
+        return {"id": session.id}
+
+    @app.get("/stats")
+    async def stats():
+        return manager.stats()
+
+    @app.get("/sessions")
+    async def list_sessions():
+        return [s.stats() for s in manager.sessions.values()]
+
+    @app.post("/sessions")
+    async def post_session(data: dict):
+        try:
+            return await new_session(data)
+        except (ValueError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    @app.delete("/sessions/{session_id}")
+    async def delete_session(session_id: str):
+        if session_id not in manager.sessions:
+            raise HTTPException(status_code=404, detail=f"no session {session_id}")
+        await manager.destroy(session_id)
+        return {"id": session_id}
+
+    @sio.event
+    async def connect(sid, environ, auth):
+        # auth: {format: "json" | "binary", session: id}, both optional
+        if not isinstance(auth, dict):
+            auth = {}
+        fmt = auth.get("format", "json")
+        if fmt not in FORMATS:
+            fmt = "json"
+        session_id = auth.get("session", DEFAULT_SESSION)
+        if not isinstance(session_id, str) or session_id not in manager.sessions:
+            raise socketio.exceptions.ConnectionRefusedError(f"no session {session_id}")
+        await sio.save_session(sid, {"format": fmt})
+        await manager.join(sid, session_id, fmt)
+
+    @sio.event
+    async def disconnect(sid, *args):
+        await manager.leave(sid)
+
+    @sio.event
+    async def resync(sid):
+        # the client missed a patch
+        session = manager.session_of(sid)
+        if session is not None:
+            session.request_keyframe(sid)
+
+    @sio.event
+    async def move_to(sid, data):
+        # data: {id, x, y}
+        session = manager.session_of(sid)
+        if session is None:
+            return {"error": "not in a session"}
+        try:
+            rid, x, y = data["id"], int(data["x"]), int(data["y"])
+        except (KeyError, TypeError, ValueError):
+            rid = None
+        if not isinstance(rid, str):
+            return {"error": "move_to needs {id, x, y}"}
+        session.move_to(rid, x, y)
+
+    @sio.event
+    async def join_session(sid, data):
+        session_id = payload_id(data)
+        if session_id not in manager.sessions:
+            return {"error": f"no session {session_id}"}
+        fmt = (await sio.get_session(sid)).get("format", "json")
+        await manager.join(sid, session_id, fmt)
+        return {"id": session_id}
+
+    @sio.event
+    async def create_session(sid, data):
+        if data is not None and not isinstance(data, dict):
+            return {"error": "create_session needs an object"}
+        try:
+            return await new_session(data or {})
+        except (ValueError, TypeError) as e:
+            return {"error": str(e)}
+
+    @sio.event
+    async def destroy_session(sid, data):
+        session_id = payload_id(data)
+        if session_id not in manager.sessions:
+            return {"error": f"no session {session_id}"}
+        await manager.destroy(session_id)
+        return {"id": session_id}
 
     @asynccontextmanager
     async def lifespan(app: FastAPI):
-        CELL_SIZE_M = Robot.config.cell_size_m
-        root = Path(__file__).resolve().parents[1] / "public"
-        grid: Grid = get_grid(str(root / "maps" / "sorter-20x14.map"))
-
-        robots: dict[str, Robot] = {
-            "r1": Robot(Position.from_grid(GridPose(3, 10, Orientation.X_RIGHT), CELL_SIZE_M)),
-            "r2": Robot(Position.from_grid(GridPose(1, 10, Orientation.X_RIGHT), CELL_SIZE_M))
-        }
-
-        obs = set(map(tuple, grid["obstacles"]))
-        def blocked(nx: int, ny: int) -> bool:
-            if nx < 0 or ny < 0 or nx >= grid["width"] or ny >= grid["height"]:
-                return True
-            return (nx, ny) in obs
-
-        base_xy = (robots["r1"].position.grid.x, robots["r1"].position.grid.y)
-
-        destination_bins = [
-            DestinationBin(1, 8, 10),
-            DestinationBin(2, 6, 10),
-        ]
-
-        hivemind = Hivemind(robots, grid, blocked, base_xy, destination_bins, seed=0)
-
-        def current_state():
-            return {
-                "grid": grid,
-                "cellSizeM": CELL_SIZE_M,
-                "base": {"x": base_xy[0], "y": base_xy[1]},
-                "destinationBins": [
-                    {"id": b.id, "x": b.x, "y": b.y, "capacity": b.capacity, "items": list(b.items)}
-                    for b in destination_bins
-                ],
-                "robots": [
-                    {
-                        "id": rid,
-                        "grid": {
-                            "x": r.position.grid.x,
-                            "y": r.position.grid.y,
-                            "rotation": int(r.position.grid.rotation),
-                        },
-                        "absolute": {
-                            "x": r.position.absolute.x,
-                            "y": r.position.absolute.y,
-                            "rotationDeg": r.position.absolute.rotation_deg,
-                        },
-                        "path": r.path,
-                    }
-                    for rid, r in robots.items()
-                ],
-            }
-
-        async def state_loop():
-            dt = 0.01
-            try:
-                while True:
-                    for r in robots.values(): r.update(dt)
-                    hivemind.step()
-                    await sio.emit("game_state", current_state())
-                    await asyncio.sleep(dt)
-            except asyncio.CancelledError:
-                pass
-
-        @sio.event
-        async def connect(sid, environ, auth):
-            print("bins now:", [(b.id, b.x, b.y) for b in destination_bins])
-            await sio.emit("game_state", current_state(), to=sid)
-
-        task = sio.start_background_task(state_loop)
+        await manager.start()
+        await new_session({"id": DEFAULT_SESSION, **({"worker": 0} if sim_process else {})})
         try:
             yield
         finally:
-            task.cancel()
-            with contextlib.suppress(Exception):
-                await task
+            await manager.stop()
 
     app.router.lifespan_context = lifespan
-    return socketio.ASGIApp(sio, other_asgi_app=app)
\ No newline at end of file
+    return socketio.ASGIApp(sio, other_asgi_app=app)
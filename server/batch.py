@@ -0,0 +1,233 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+
+import numpy as np
+
+from .mapf_utils import Grid, get_grid, get_scenario
+from .pibt import PIBT
+from .validator import MAPFViolation, configs_to_ids, validate_plan
+
+
+@dataclass(frozen=True)
+class Job:
+    map_file: str
+    scen_file: str
+    N: int
+    seed: int
+
+    @property
+    def key(self) -> tuple:
+        return (self.map_file, self.scen_file, self.N, self.seed)
+
+
+@dataclass
+class JobResult:
+    map_file: str
+    scen_file: str
+    N: int
+    seed: int
+    success: bool
+    makespan: int
+    sum_of_costs: int
+    wall_time: float
+    error: str = ""
+    crashed: bool = False  # solve raised, unlike a finished but failed run
+
+
+FIELDS = list(JobResult.__dataclass_fields__)
+
+# per worker process, maps are parsed once; distance tables are shared
+# through dist_cache.DIST_CACHE which is process-wide as well
+_grids: dict[str, Grid] = {}
+
+
+def get_grid_cached(map_file: str) -> Grid:
+    grid = _grids.get(map_file)
+    if grid is None:
+        grid = get_grid(map_file)
+        _grids[map_file] = grid
+    return grid
+
+
+def solve(job: Job, max_timestep: int) -> JobResult:
+    grid = get_grid_cached(job.map_file)
+    starts, goals = get_scenario(job.scen_file, job.N)
+
+    t_start = time.perf_counter()
+    plan = PIBT(grid, starts, goals, seed=job.seed).run(max_timestep=max_timestep)
+    wall_time = time.perf_counter() - t_start
+
+    W = grid.shape[1]
+    plan_ids = configs_to_ids(grid, plan)
+    goal_ids = np.array([y * W + x for (y, x) in goals], dtype=np.int64)
+    start_ids = np.array([y * W + x for (y, x) in starts], dtype=np.int64)
+
+    # cost of each agent: last timestep off its goal, plus one
+    off_goal = plan_ids != goal_ids
+    last_off = np.where(
+        off_goal.any(axis=0),
+        len(plan_ids) - np.argmax(off_goal[::-1], axis=0),
+        0,
+    )
+
+    error = ""
+    try:
+        validate_plan(grid, start_ids, goal_ids, plan_ids)
+    except MAPFViolation as e:
+        error = str(e)
+
+    return JobResult(
+        *job.key,
+        success=(error == ""),
+        makespan=len(plan) - 1,
+        sum_of_costs=int(last_off.sum()),
+        wall_time=wall_time,
+        error=error,
+    )
+
+
+def make_jobs(
+    instances: list[tuple[str, str]], agents: list[int], seeds: list[int]
+) -> list[Job]:
+    return [
+        Job(map_file, scen_file, N, seed)
+        for (map_file, scen_file), N, seed in itertools.product(instances, agents, seeds)
+    ]
+
+
+def trim_partial(out_file: str) -> None:
+    # a sweep killed mid-write leaves a partial last row; cut it, so that
+    # the rows appended on resume start on a line of their own
+    if not os.path.exists(out_file):
+        return
+    with open(out_file, "rb+") as f:
+        data = f.read()
+        if len(data) > 0 and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def load_done(out_file: str) -> set[tuple]:
+    # keys of finished jobs, so that a partially finished sweep can resume.
+    # crashed jobs are not done and run again, unsolved or invalid runs are
+    # results like any other; when a key appears more than once the last row
+    # is the current one
+    done: set[tuple] = set()
+    if not os.path.exists(out_file):
+        return done
+    with open(out_file, "r", newline="") as f:
+        if out_file.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = []
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    continue
+    for row in rows:
+        try:
+            key = (row["map_file"], row["scen_file"], int(row["N"]), int(row["seed"]))
+        except (KeyError, TypeError, ValueError):
+            continue  # not a complete row
+        if row.get("crashed") in (True, "True"):
+            done.discard(key)
+        else:
+            done.add(key)
+    return done
+
+
+class ResultSink:
+    # appends one row per finished job, JSONL or CSV by file extension;
+    # without append the file starts over
+    def __init__(self, out_file: str, append: bool = True):
+        dirname = os.path.dirname(out_file)
+        if len(dirname) > 0:
+            os.makedirs(dirname, exist_ok=True)
+        self.is_csv = out_file.endswith(".csv")
+        new_file = not append or not os.path.exists(out_file) or os.path.getsize(out_file) == 0
+        if self.is_csv and not new_file:
+            # rows are appended under the existing header
+            with open(out_file, "r", newline="") as f:
+                header = next(csv.reader(f), [])
+            if header != FIELDS:
+                raise ValueError(f"{out_file} has columns {header}, expected {FIELDS}")
+        self.f = open(out_file, "a" if append else "w", newline="")
+        if self.is_csv:
+            self.writer = csv.DictWriter(self.f, fieldnames=FIELDS)
+            if new_file:
+                self.writer.writeheader()
+
+    def write(self, result: JobResult) -> None:
+        if self.is_csv:
+            self.writer.writerow(asdict(result))
+        else:
+            self.f.write(json.dumps(asdict(result)) + "\n")
+        self.f.flush()
+
+    def close(self) -> None:
+        self.f.close()
+
+
+def run_batch(
+    jobs: list[Job],
+    out_file: str,
+    max_timestep: int = 1000,
+    workers: int | None = None,
+    resume: bool = True,
+) -> int:
+    if resume:
+        trim_partial(out_file)
+    done = load_done(out_file) if resume else set()
+    todo = [job for job in jobs if job.key not in done]
+    sink = ResultSink(out_file, append=resume)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(solve, job, max_timestep): job for job in todo}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = JobResult(*job.key, False, -1, -1, 0.0, repr(e), crashed=True)
+                sink.write(result)
+    finally:
+        sink.close()
+    return len(todo)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="PIBT regression sweep")
+    parser.add_argument(
+        "--instance",
+        nargs=2,
+        action="append",
+        metavar=("MAP", "SCEN"),
+        required=True,
+    )
+    parser.add_argument("--agents", type=int, nargs="+", required=True)
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--max-timestep", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default="results.jsonl", help=".jsonl or .csv")
+    parser.add_argument("--no-resume", action="store_true")
+    args = parser.parse_args()
+
+    jobs = make_jobs([tuple(x) for x in args.instance], args.agents, args.seeds)
+    n = run_batch(
+        jobs,
+        args.out,
+        max_timestep=args.max_timestep,
+        workers=args.workers,
+        resume=not args.no_resume,
+    )
+    print(f"solved {n} of {len(jobs)} jobs, results in {args.out}")
+
+
+if __name__ == "__main__":
+    main()
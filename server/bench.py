@@ -0,0 +1,285 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Unix only
+    resource = None
+
+from .abomination import Simulator
+from .dist_cache import DIST_CACHE
+from .mapf_utils import Grid, get_grid
+from .pibt import PIBT
+from .profiler import PhaseProfiler
+
+ROOT = Path(__file__).resolve().parents[1]
+MAPS_DIR = ROOT / "public" / "maps"
+
+SUITES = {
+    "quick": {
+        "maps": ["sorter-20x14", "random-32-32-20", "open-64", "random-128-20"],
+        "agents": [8, 32, 128],
+        "seeds": [0],
+        "steps": 50,
+    },
+    "full": {
+        "maps": [
+            "sorter-20x14",
+            "random-32-32-20",
+            "open-64",
+            "random-128-20",
+            "open-256",
+            "random-256-20",
+        ],
+        "agents": [8, 64, 512, 2048, 4096],
+        "seeds": [0, 1, 2],
+        "steps": 200,
+    },
+}
+
+
+@dataclass(frozen=True)
+class Case:
+    target: str  # "pibt" or "simulator"
+    map_name: str
+    N: int
+    seed: int
+    steps: int
+    profile: bool = False
+
+    @property
+    def id(self) -> str:
+        return f"{self.target}/{self.map_name}/N{self.N}/s{self.seed}"
+
+
+def get_map(name: str) -> Grid:
+    # bundled maps by name, or synthetic "open-<size>" / "random-<size>-<pct>"
+    path = MAPS_DIR / f"{name}.map"
+    if path.exists():
+        return get_grid(str(path))
+    parts = name.split("-")
+    size = int(parts[1])
+    if parts[0] == "open":
+        return np.ones((size, size), dtype=bool)
+    rng = np.random.default_rng(size)
+    return rng.random((size, size)) >= int(parts[2]) / 100
+
+
+def sample_cells(grid: Grid, k: int, rng: np.random.Generator) -> list[tuple[int, int]]:
+    cells = np.argwhere(grid)
+    idx = rng.choice(len(cells), size=k, replace=False)
+    return [(int(y), int(x)) for y, x in cells[idx]]
+
+
+def percentiles(samples: list[float]) -> dict:
+    if len(samples) == 0:
+        return {}
+    a = np.asarray(samples) * 1e3
+    return {
+        "p50_ms": float(np.percentile(a, 50)),
+        "p90_ms": float(np.percentile(a, 90)),
+        "p99_ms": float(np.percentile(a, 99)),
+        "max_ms": float(a.max()),
+        "mean_ms": float(a.mean()),
+    }
+
+
+def run_case(case: Case) -> dict:
+    grid = get_map(case.map_name)
+    rng = np.random.default_rng(case.seed)
+    DIST_CACHE.clear()
+
+    if case.target == "pibt":
+        cells = sample_cells(grid, 2 * case.N, rng)
+        starts, goals = cells[: case.N], cells[case.N :]
+        t0 = time.perf_counter()
+        prof = PhaseProfiler() if case.profile else None
+        solver = PIBT(grid, starts, goals, seed=case.seed, profiler=prof)
+        # PIBT's tables fill lazily, which would otherwise land in the step
+        # times; the simulator's are complete when built
+        t1 = time.perf_counter()
+        for table in solver.dist_tables:
+            table.fill()
+        dist_tables_s = time.perf_counter() - t1
+        it = solver.run_iter(case.steps)
+        next(it)  # initial configuration and priorities
+        setup = time.perf_counter() - t0
+
+        def step():
+            next(it)
+    else:
+        n_loaders = max(4, case.N // 8)
+        n_dumps = max(8, case.N // 4)
+        n_chargers = max(2, case.N // 16)
+        n_stations = n_loaders + n_dumps + n_chargers
+        cells = sample_cells(grid, n_stations + case.N, rng)
+        loaders = cells[:n_loaders]
+        dumps = cells[n_loaders : n_loaders + n_dumps]
+        chargers = cells[n_loaders + n_dumps : n_stations]
+        starts = cells[n_stations:]
+        t0 = time.perf_counter()
+        sim = Simulator(grid, starts, loaders, dumps, chargers, seed=case.seed, profile=case.profile)
+        setup = time.perf_counter() - t0
+        dist_tables_s = None  # built inside the constructor, part of setup_s
+        prof = sim.prof if case.profile else None
+        step = sim.step
+
+    latencies: list[float] = []
+    for _ in range(case.steps):
+        t0 = time.perf_counter()
+        try:
+            step()
+        except StopIteration:
+            break  # all agents reached their goals
+        latencies.append(time.perf_counter() - t0)
+
+    total = sum(latencies)
+    peak_rss_mb = None
+    if resource is not None:
+        # ru_maxrss is in KiB on Linux, bytes on macOS
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (
+            2**20 if sys.platform == "darwin" else 2**10
+        )
+    profile = {}
+    if prof is not None:
+        summary = prof.summary()
+        profile = {
+            "phases_ms": {k: v["mean_ms"] for k, v in summary["phases"].items()},
+            "counters": {k: v["mean"] for k, v in summary["counters"].items()},
+        }
+    return {
+        "case": case.id,
+        **asdict(case),
+        "setup_s": setup,
+        "dist_tables_s": dist_tables_s,
+        "steps_run": len(latencies),
+        **percentiles(latencies),
+        "agent_steps_per_s": case.N * len(latencies) / total if total > 0 else 0.0,
+        "dist_tables_built": DIST_CACHE.misses,
+        "peak_rss_mb": peak_rss_mb,
+        **profile,
+    }
+
+
+def make_cases(suite: dict, targets: list[str], profile: bool = False) -> list[Case]:
+    free = {name: int(get_map(name).sum()) for name in suite["maps"]}
+    cases = []
+    for target, name, N, seed in itertools.product(
+        targets, suite["maps"], suite["agents"], suite["seeds"]
+    ):
+        # leave room for goals and stations
+        if 3 * N > free[name]:
+            continue
+        cases.append(Case(target, name, N, seed, suite["steps"], profile))
+    return cases
+
+
+def environment() -> dict:
+    try:
+        rev = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        rev = ""
+    return {
+        "git_rev": rev,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def run_suite(cases: list[Case], repeat: int = 3) -> list[dict]:
+    # one fresh process per run, one at a time, so that peak memory and
+    # caches do not leak between cases and timings do not interfere;
+    # the best of repeat runs (lowest p50) is kept to damp machine noise
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    with ProcessPoolExecutor(1, mp_context=ctx, max_tasks_per_child=1) as pool:
+        runs = list(pool.map(run_case, [c for c in cases for _ in range(repeat)]))
+        for k, case in enumerate(cases):
+            res = min(runs[k * repeat : (k + 1) * repeat], key=lambda r: r.get("p50_ms", 0))
+            res["repeat"] = repeat
+            rss = res["peak_rss_mb"]
+            rss = f"{rss:7.1f}" if rss is not None else "      -"
+            print(
+                f"{case.id:48s} p50 {res.get('p50_ms', 0):9.3f} ms"
+                f"  p99 {res.get('p99_ms', 0):9.3f} ms"
+                f"  setup {res['setup_s']:7.3f} s"
+                f"  {rss} MB"
+            )
+            results.append(res)
+    return results
+
+
+def compare(results: list[dict], baseline: dict, threshold: float) -> list[str]:
+    # slowdowns beyond threshold on cases present in both runs
+    base = {r["case"]: r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        b = base.get(r["case"])
+        if b is None:
+            continue
+        for key in ("p50_ms", "p99_ms", "setup_s"):
+            if key in r and key in b and b[key] > 0 and r[key] / b[key] > threshold:
+                regressions.append(
+                    f"{r['case']} {key}: {b[key]:.3f} -> {r[key]:.3f}"
+                    f" (x{r[key] / b[key]:.2f})"
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="PIBT / Simulator scaling benchmark")
+    parser.add_argument("--suite", choices=list(SUITES), default="quick")
+    parser.add_argument(
+        "--target", choices=["pibt", "simulator"], nargs="+", default=["pibt", "simulator"]
+    )
+    parser.add_argument("--out", default=None, help="results JSON, default bench/<suite>-<rev>.json")
+    parser.add_argument(
+        "--compare",
+        default=None,
+        help="baseline JSON to compare against, e.g. bench/baseline-quick.json",
+    )
+    parser.add_argument("--threshold", type=float, default=1.2)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, best kept")
+    parser.add_argument("--profile", action="store_true", help="record per-phase times")
+    args = parser.parse_args()
+
+    env = environment()
+    results = run_suite(make_cases(SUITES[args.suite], args.target, args.profile), args.repeat)
+
+    out = args.out or str(ROOT / "bench" / f"{args.suite}-{env['git_rev'] or 'local'}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump({"suite": args.suite, "env": env, "results": results}, f, indent=1)
+    print(f"results in {out}")
+
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print("REGRESSION", line)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import hashlib
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+import numpy as np
+
+from .mapf_utils import Grid
+
+
+def grid_fingerprint(grid: Grid) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(grid.shape).encode())
+    h.update(np.packbits(grid.astype(bool)).tobytes())
+    return h.hexdigest()
+
+
+class DistTableCache:
+    # process-wide LRU of distance tables keyed by (kind, grid fingerprint, goal);
+    # entries must expose nbytes, lazy tables keep completing in place once shared.
+    # pinned tables, e.g. views into shared memory, are never evicted and do
+    # not count against max_bytes
+    def __init__(self, max_bytes: int = 256 * 2**20):
+        self.max_bytes = max_bytes
+        self.tables: OrderedDict[Hashable, Any] = OrderedDict()
+        self.pinned: dict[Hashable, Any] = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        table = self.pinned.get(key)
+        if table is not None:
+            self.hits += 1
+            return table
+        table = self.tables.get(key)
+        if table is not None:
+            self.hits += 1
+            self.tables.move_to_end(key)
+            return table
+
+        self.misses += 1
+        table = build()
+        self.put(key, table)
+        return table
+
+    def put(self, key: Hashable, table: Any, pin: bool = False) -> None:
+        old = self.tables.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        self.pinned.pop(key, None)
+        if pin:
+            self.pinned[key] = table
+            return
+        self.tables[key] = table
+        self.nbytes += table.nbytes
+        self.evict()
+
+    def evict(self) -> None:
+        # the newest entry always stays, even if it alone exceeds the budget
+        while self.nbytes > self.max_bytes and len(self.tables) > 1:
+            _, table = self.tables.popitem(last=False)
+            self.nbytes -= table.nbytes
+            self.evictions += 1
+
+    def resize(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.evict()
+
+    def clear(self) -> None:
+        self.tables.clear()
+        self.pinned.clear()
+        self.nbytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.tables),
+            "nbytes": self.nbytes,
+            "pinned": len(self.pinned),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+DIST_CACHE = DistTableCache()
+
+
+def get_dist_table(
+    grid: Grid,
+    goal: Hashable,
+    factory: Callable[[Grid, Any], Any],
+    fingerprint: str | None = None,
+) -> Any:
+    # fingerprint can be passed by callers that look up many goals on one grid
+    if fingerprint is None:
+        fingerprint = grid_fingerprint(grid)
+    return DIST_CACHE.get((factory, fingerprint, goal), lambda: factory(grid, goal))
+
+
+def put_dist_table(
+    grid: Grid,
+    goal: Hashable,
+    factory: Callable[[Grid, Any], Any],
+    table: Any,
+    fingerprint: str | None = None,
+    pin: bool = False,
+) -> None:
+    # registers a table built elsewhere under the key get_dist_table looks up
+    if fingerprint is None:
+        fingerprint = grid_fingerprint(grid)
+    DIST_CACHE.put((factory, fingerprint, goal), table, pin)
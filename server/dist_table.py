@@ -1,22 +1,75 @@
-from collections import deque
 from dataclasses import dataclass, field
 
 import numpy as np
 
-from .mapf_utils import Coord, Grid, get_neighbors, is_valid_coord
+from .mapf_utils import Coord, Grid, is_valid_coord
+
+
+def expand_frontier(
+    passable: np.ndarray,
+    dist: np.ndarray,
+    frontier: np.ndarray,
+    width: int,
+    level: int,
+    unreached: int,
+) -> np.ndarray:
+    # one BFS level on flat cell ids: shift the whole frontier left/right/up/down,
+    # keep unreached passable cells and label them with level
+    V = dist.size
+    x = frontier % width
+    C = np.concatenate(
+        (
+            frontier[x > 0] - 1,
+            frontier[x < width - 1] + 1,
+            frontier[frontier >= width] - width,
+            frontier[frontier < V - width] + width,
+        )
+    )
+    C = C[passable[C] & (dist[C] == unreached)]
+
+    # drop duplicates, using dist itself as a scratch tag
+    tag = -1 - np.arange(C.size)
+    dist[C] = tag
+    C = C[dist[C] == tag]
+    dist[C] = level
+    return C
+
+
+def bfs_distances(grid: Grid, goal: Coord, unreached: int, dtype=np.int32) -> np.ndarray:
+    # full distance field, level by level
+    dist = np.full(grid.size, unreached, dtype=dtype)
+    passable = grid.reshape(-1).astype(bool)
+    width = grid.shape[1]
+    g = goal[0] * width + goal[1]
+    if not passable[g]:
+        return dist.reshape(grid.shape)
+    dist[g] = 0
+    frontier = np.array([g], dtype=np.int64)
+    level = 0
+    while len(frontier) > 0:
+        level += 1
+        frontier = expand_frontier(passable, dist, frontier, width, level, unreached)
+    return dist.reshape(grid.shape)
 
 
 @dataclass
 class DistTable:
     grid: Grid
     goal: Coord
-    Q: deque = field(init=False)  # lazy distance evaluation
+    frontier: np.ndarray = field(init=False)  # lazy distance evaluation
     table: np.ndarray = field(init=False)  # distance matrix
+    level: int = field(init=False, default=0)
 
     def __post_init__(self):
-        self.Q = deque([self.goal])
         self.table = np.full(self.grid.shape, self.grid.size, dtype=int)
         self.table[self.goal] = 0
+        self.passable = self.grid.reshape(-1).astype(bool)
+        g = self.goal[0] * self.grid.shape[1] + self.goal[1]
+        self.frontier = np.array([g] if self.passable[g] else [], dtype=np.int64)
+
+    @property
+    def nbytes(self) -> int:
+        return self.table.nbytes
 
     def get(self, target: Coord) -> int:
         # check valid input
@@ -27,15 +80,26 @@ class DistTable:
         if self.table[target] < self.table.size:
             return self.table[target]
 
-        # BFS with lazy evaluation
-        while len(self.Q) > 0:
-            u = self.Q.popleft()
-            d = int(self.table[u])
-            for v in get_neighbors(self.grid, u):
-                if d + 1 < self.table[v]:
-                    self.table[v] = d + 1
-                    self.Q.append(v)
-            if u == target:
-                return d
-
-        return self.grid.size
\ No newline at end of file
+        # BFS with lazy evaluation, one whole level at a time
+        while len(self.frontier) > 0:
+            self.expand()
+            if self.table[target] < self.table.size:
+                return self.table[target]
+
+        return self.grid.size
+
+    def expand(self) -> None:
+        self.level += 1
+        self.frontier = expand_frontier(
+            self.passable,
+            self.table.reshape(-1),
+            self.frontier,
+            self.grid.shape[1],
+            self.level,
+            self.grid.size,
+        )
+
+    def fill(self) -> None:
+        # the whole table now rather than on demand, e.g. to time it up front
+        while len(self.frontier) > 0:
+            self.expand()
@@ -0,0 +1,115 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+EVENT_TYPES = (
+    "arrived_loader",
+    "arrived_dump",
+    "arrived_charger",
+    "goal_loader",
+    "goal_dump",
+    "goal_charge",
+    "dwell_finished",
+    "leave_charger",
+    "battery",
+    "loader_claimed",
+    "dump_claimed",
+    "charger_claimed",
+)
+(
+    ARRIVED_LOADER,
+    ARRIVED_DUMP,
+    ARRIVED_CHARGER,
+    GOAL_LOADER,
+    GOAL_DUMP,
+    GOAL_CHARGE,
+    DWELL_FINISHED,
+    LEAVE_CHARGER,
+    BATTERY,
+    LOADER_CLAIMED,
+    DUMP_CLAIMED,
+    CHARGER_CLAIMED,
+) = range(len(EVENT_TYPES))
+
+# cell is a flat id (y * width + x), -1 if the event has none
+EVENT_DTYPE = np.dtype(
+    [("t", "<i8"), ("type", "u1"), ("agent", "<i4"), ("cell", "<i8"), ("value", "<i8")]
+)
+
+# key the cell goes under in the dict form, value only for the listed types
+CELL_KEYS = {
+    ARRIVED_LOADER: "at",
+    ARRIVED_DUMP: "at",
+    ARRIVED_CHARGER: "at",
+    GOAL_LOADER: "goal",
+    GOAL_DUMP: "goal",
+    GOAL_CHARGE: "goal",
+    LOADER_CLAIMED: "station",
+    DUMP_CLAIMED: "station",
+    CHARGER_CLAIMED: "station",
+}
+VALUE_KEYS = {ARRIVED_LOADER: "dwell_steps", BATTERY: "value"}
+
+
+def to_dicts(events: np.ndarray, width: int) -> list[dict]:
+    out = []
+    for t, code, agent, cell, value in events.tolist():
+        e = {"type": EVENT_TYPES[code], "agent": agent}
+        if code in CELL_KEYS:
+            e[CELL_KEYS[code]] = divmod(cell, width)
+        if code in VALUE_KEYS:
+            e[VALUE_KEYS[code]] = value
+        out.append(e)
+    return out
+
+
+class EventRing:
+    # preallocated ring of typed events; consumers pull the unread ones in
+    # order. when full, unread events are spilled to spill_path if given,
+    # otherwise the oldest are dropped (and counted)
+    def __init__(self, capacity: int = 2**16, spill_path: Optional[str] = None):
+        self.buf = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self.capacity = capacity
+        self.head = 0  # total events pushed
+        self.tail = 0  # total events pulled, spilled or dropped
+        self.dropped = 0
+        self.spilled = 0
+        self.spill_path = spill_path
+        if spill_path is not None and os.path.exists(spill_path):
+            os.remove(spill_path)
+
+    def __len__(self) -> int:
+        return self.head - self.tail
+
+    def push(self, t: int, code: int, agent: int, cell: int = -1, value: int = 0) -> None:
+        if self.head - self.tail == self.capacity:
+            if self.spill_path is not None:
+                self.spill()
+            else:
+                self.tail += 1
+                self.dropped += 1
+        self.buf[self.head % self.capacity] = (t, code, agent, cell, value)
+        self.head += 1
+
+    def peek(self, max_events: Optional[int] = None) -> np.ndarray:
+        n = len(self) if max_events is None else min(max_events, len(self))
+        k = self.tail % self.capacity
+        if k + n <= self.capacity:
+            return self.buf[k : k + n].copy()
+        return np.concatenate((self.buf[k:], self.buf[: k + n - self.capacity]))
+
+    def pull(self, max_events: Optional[int] = None) -> np.ndarray:
+        out = self.peek(max_events)
+        self.tail += len(out)
+        return out
+
+    def spill(self) -> None:
+        n = len(self)
+        with open(self.spill_path, "ab") as f:
+            self.pull().tofile(f)
+        self.spilled += n
+
+
+def read_spill(path: str) -> np.ndarray:
+    return np.fromfile(path, dtype=EVENT_DTYPE)
@@ -0,0 +1,141 @@
+import numpy as np
+
+from .grid_graph import GridGraph
+from .mapf_utils import Config, Configs, Grid
+from .pibt_stack import funcPIBT_stack
+
+
+class FlatPIBT:
+    # same algorithm as pibt.PIBT, but on flat int32 cell ids and NumPy arrays;
+    # consumes the RNG identically, hence produces the same plans for a given seed
+    def __init__(
+        self,
+        grid: Grid,
+        starts: Config,
+        goals: Config,
+        seed: int = 0,
+        use_stack: bool = False,
+    ):
+        self.grid = grid
+        self.graph = GridGraph(grid)
+        self.starts = self.graph.to_ids(starts)
+        self.goals = self.graph.to_ids(goals)
+        self.N = len(self.starts)
+
+        # distance table, one full field per distinct goal
+        fields: dict[int, np.ndarray] = {}
+        for g in self.goals.tolist():
+            if g not in fields:
+                fields[g] = self.graph.distance_field(g)
+        self.dist_tables = [fields[g] for g in self.goals.tolist()]
+
+        # cache
+        self.NIL = self.N  # meaning \bot
+        self.NIL_COORD = self.graph.V  # meaning \bot
+        self.occupied_now = np.full(self.graph.V, self.NIL, dtype=np.int32)
+        self.occupied_nxt = np.full(self.graph.V, self.NIL, dtype=np.int32)
+
+        # used for tie-breaking
+        self.rng = np.random.default_rng(seed)
+
+        # priority inheritance without recursion, see pibt_stack
+        self.use_stack = use_stack
+        self.max_chain_depth = 0  # longest inheritance chain in the last step
+
+    def candidates(self, Q_from: np.ndarray, i: int) -> list[int]:
+        # get candidate next vertices
+        u = Q_from[i]
+        C = self.graph.cand_indices[
+            self.graph.cand_indptr[u] : self.graph.cand_indptr[u + 1]
+        ].copy()
+        self.rng.shuffle(C)  # tie-breaking, randomize
+        return C[np.argsort(self.dist_tables[i][C], kind="stable")].tolist()
+
+    def funcPIBT(
+        self, Q_from: np.ndarray, Q_to: np.ndarray, i: int, depth: int = 1
+    ) -> bool:
+        # true -> valid, false -> invalid
+        self.max_chain_depth = max(self.max_chain_depth, depth)
+        u = int(Q_from[i])
+        C = self.candidates(Q_from, i)
+
+        # vertex assignment
+        for v in C:
+            # avoid vertex collision
+            if self.occupied_nxt[v] != self.NIL:
+                continue
+
+            j = int(self.occupied_now[v])
+
+            # avoid edge collision
+            if j != self.NIL and Q_to[j] == u:
+                continue
+
+            # reserve next location
+            Q_to[i] = v
+            self.occupied_nxt[v] = i
+
+            # priority inheritance (j != i due to the second condition)
+            if (
+                j != self.NIL
+                and (Q_to[j] == self.NIL_COORD)
+                and (not self.funcPIBT(Q_from, Q_to, j, depth + 1))
+            ):
+                continue
+
+            return True
+
+        # failed to secure node
+        Q_to[i] = u
+        self.occupied_nxt[u] = i
+        return False
+
+    def step(self, Q_from: np.ndarray, priorities: np.ndarray) -> np.ndarray:
+        # setup
+        N = len(Q_from)
+        Q_to = np.full(N, self.NIL_COORD, dtype=np.int32)
+        self.occupied_now[Q_from] = np.arange(N, dtype=np.int32)
+
+        # perform PIBT, stable sort keeps ties in index order like sorted()
+        self.max_chain_depth = 0
+        A = np.argsort(-np.asarray(priorities), kind="stable")
+        for i in A.tolist():
+            if Q_to[i] != self.NIL_COORD:
+                continue
+            if self.use_stack:
+                _, depth = funcPIBT_stack(self, Q_from, Q_to, i)
+                self.max_chain_depth = max(self.max_chain_depth, depth)
+            else:
+                self.funcPIBT(Q_from, Q_to, i)
+
+        # cleanup
+        self.occupied_now[Q_from] = self.NIL
+        self.occupied_nxt[Q_to] = self.NIL
+
+        return Q_to
+
+    def run_ids(self, max_timestep: int = 1000) -> np.ndarray:
+        # define priorities
+        priorities = np.array(
+            [self.dist_tables[i][v] for i, v in enumerate(self.starts.tolist())],
+            dtype=np.float64,
+        ) / self.grid.size
+
+        # main loop, generate sequence of configurations
+        configs = [self.starts]
+        while len(configs) <= max_timestep:
+            # obtain new configuration
+            Q = self.step(configs[-1], priorities)
+            configs.append(Q)
+
+            # update priorities & goal check
+            not_reached = Q != self.goals
+            priorities[not_reached] += 1
+            priorities[~not_reached] -= np.floor(priorities[~not_reached])
+            if not not_reached.any():
+                break  # goal
+
+        return np.stack(configs)
+
+    def run(self, max_timestep: int = 1000) -> Configs:
+        return [self.graph.to_config(Q) for Q in self.run_ids(max_timestep)]
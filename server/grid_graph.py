@@ -0,0 +1,71 @@
+import numpy as np
+
+from .dist_table import bfs_distances
+from .mapf_utils import Config, Coord, Grid
+
+
+class GridGraph:
+    # flat cell ids: v = y * width + x
+    def __init__(self, grid: Grid):
+        self.grid = grid
+        self.height, self.width = grid.shape
+        self.V = grid.size
+        self.passable = grid.reshape(-1).astype(bool)
+
+        # CSR neighbor table, same order as mapf_utils.get_neighbors
+        self.indptr, self.indices = neighbor_csr(grid)
+
+        # candidate table for PIBT, i.e., [v] + neighbors(v)
+        self.cand_indptr, self.cand_indices = neighbor_csr(grid, include_self=True)
+
+    def to_id(self, coord: Coord) -> int:
+        y, x = coord
+        return y * self.width + x
+
+    def to_coord(self, v: int) -> Coord:
+        return divmod(int(v), self.width)
+
+    def to_ids(self, config: Config) -> np.ndarray:
+        if len(config) == 0:
+            return np.zeros(0, dtype=np.int32)
+        yx = np.asarray(config, dtype=np.int32)
+        return yx[:, 0] * self.width + yx[:, 1]
+
+    def to_config(self, ids: np.ndarray) -> Config:
+        return [divmod(v, self.width) for v in np.asarray(ids).tolist()]
+
+    def neighbors(self, v: int) -> np.ndarray:
+        return self.indices[self.indptr[v] : self.indptr[v + 1]]
+
+    def distance_field(self, goal: int) -> np.ndarray:
+        # unreachable cells keep V, same as DistTable
+        return bfs_distances(self.grid, self.to_coord(goal), self.V).reshape(-1)
+
+
+def neighbor_table(grid: Grid, include_self: bool = False) -> np.ndarray:
+    H, W = grid.shape
+    ok = grid.astype(bool)
+    ids = np.arange(H * W, dtype=np.int32).reshape(H, W)
+
+    # columns: [self], left, right, up, down; -1 means no edge
+    cols = []
+    if include_self:
+        cols.append(np.where(ok, ids, -1))
+    for dy, dx in ((0, -1), (0, 1), (-1, 0), (1, 0)):
+        col = np.full((H, W), -1, dtype=np.int32)
+        ys = slice(max(-dy, 0), H - max(dy, 0))
+        xs = slice(max(-dx, 0), W - max(dx, 0))
+        ys_n = slice(max(dy, 0), H - max(-dy, 0))
+        xs_n = slice(max(dx, 0), W - max(-dx, 0))
+        col[ys, xs] = np.where(ok[ys, xs] & ok[ys_n, xs_n], ids[ys_n, xs_n], -1)
+        cols.append(col)
+    return np.stack(cols, axis=-1).reshape(H * W, len(cols))
+
+
+def neighbor_csr(grid: Grid, include_self: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    table = neighbor_table(grid, include_self)
+    valid = table >= 0
+    indptr = np.zeros(len(table) + 1, dtype=np.int32)
+    np.cumsum(valid.sum(axis=1), out=indptr[1:])
+    indices = table[valid].astype(np.int32)
+    return indptr, indices
@@ -1,30 +1,20 @@
-import re
 from typing import TypedDict
 
+import numpy as np
+
+from .mapf_utils import get_grid as get_grid_array
+
 class Grid(TypedDict):
   width: int
   height: int
   obstacles: list[tuple[int, int]]
 
+def to_grid_dict(grid: np.ndarray) -> Grid:
+  # dict form used by app.py, obstacles as (x, y)
+  height, width = grid.shape
+  ys, xs = np.nonzero(~grid)
+  obstacles = list(zip(xs.tolist(), ys.tolist()))
+  return {"width": width, "height": height, "obstacles": obstacles}
+
 def get_grid(map_file: str) -> Grid:
-  width, height = 0, 0
-  with open(map_file, "r", encoding="utf-8") as f:
-    for line in f:
-      s = line.strip().lower()
-      m = re.match(r"width\s+(\d+)", s)
-      if m: width = int(m.group(1)); continue
-      m = re.match(r"height\s+(\d+)", s)
-      if m: height = int(m.group(1)); continue
-      if s == "map": break
-    rows: list[str] = []
-    for _ in range(height):
-      row = f.readline().rstrip("\n")
-      rows.append(row)
-  assert len(rows) == height
-  obstacles: list[tuple[int, int]] = []
-  for y, row in enumerate(rows):
-    if len(row) != width: raise ValueError("row width mismatch")
-    for x, ch in enumerate(row):
-      if ch == "@":
-        obstacles.append((x, y))
-  return {"width": width, "height": height, "obstacles": obstacles}
\ No newline at end of file
+  return to_grid_dict(get_grid_array(map_file))
@@ -1,5 +1,7 @@
+import hashlib
 import os
 import re
+from dataclasses import dataclass
 from typing import TypeAlias
 
 import numpy as np
@@ -11,6 +13,77 @@ Config: TypeAlias = list[Coord]
 Configs: TypeAlias = list[Config]
 
 
+# parsed map cache, server-side so that nothing is written next to maps under
+# public/ (served and bundled by the frontend); MAPF_CACHE_DIR overrides it
+MAP_CACHE_DIR = os.environ.get(
+    "MAPF_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mapcache")
+)
+
+
+@dataclass
+class MapData:
+    grid: Grid  # passable cells, y, x
+    cell_ids: np.ndarray  # flat ids (y * width + x) of passable cells
+    cell_index: np.ndarray  # flat id -> index in cell_ids, -1 for obstacles
+
+
+def parse_map(text: bytes) -> Grid:
+    lines = text.splitlines()
+    height, width, k = 0, 0, 0
+    while k < len(lines):
+        s = lines[k].strip().lower()
+        k += 1
+        m = re.match(rb"(height|width)\s+(\d+)", s)
+        if m:
+            if m.group(1) == b"height":
+                height = int(m.group(2))
+            else:
+                width = int(m.group(2))
+        elif s == b"map":
+            break
+
+    # vectorized row conversion
+    rows = [row.ljust(width)[:width] for row in lines[k : k + height]]
+    if len(rows) != height:
+        raise ValueError("map has fewer rows than its height")
+    chars = np.frombuffer(b"".join(rows), dtype=np.uint8).reshape(height, width)
+    return (chars == ord(".")) | (chars == ord("G")) | (chars == ord("S"))
+
+
+def load_map(map_file: str) -> MapData:
+    # parsed maps are cached in a binary file keyed by the file hash,
+    # MAP_CACHE_DIR/<name>.<hash>.npz
+    with open(map_file, "rb") as f:
+        text = f.read()
+    digest = hashlib.blake2b(text, digest_size=8).hexdigest()
+    cache_dir = MAP_CACHE_DIR
+    cache_file = os.path.join(cache_dir, f"{os.path.basename(map_file)}.{digest}.npz")
+
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as data:
+            return MapData(data["grid"], data["cell_ids"], data["cell_index"])
+
+    grid = parse_map(text)
+    cell_ids = np.flatnonzero(grid).astype(np.int32)
+    cell_index = np.full(grid.size, -1, dtype=np.int32)
+    cell_index[cell_ids] = np.arange(len(cell_ids), dtype=np.int32)
+    map_data = MapData(grid, cell_ids, cell_index)
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_file, grid=grid, cell_ids=cell_ids, cell_index=cell_index)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass  # read-only location, parse again next time
+
+    return map_data
+
+
+def get_grid(map_file: str) -> Grid:
+    return load_map(map_file).grid
+
+
 def get_scenario(scen_file: str, N: int | None = None) -> tuple[Config, Config]:
     with open(scen_file, "r") as f:
         starts, goals = [], []
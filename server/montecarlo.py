@@ -0,0 +1,279 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from . import events as ev
+from .abomination import CHARGING, DistTable, Simulator
+from .batch import trim_partial
+from .dist_cache import grid_fingerprint, put_dist_table
+from .dist_table import bfs_distances
+from .mapf_utils import Coord, Grid, get_grid
+
+UNREACHED = np.iinfo(np.int32).max
+METRICS = ["throughput", "queue_wait", "charger_utilization"]
+
+
+@dataclass
+class Layout:
+    grid: Grid
+    loaders: list[Coord]
+    dumps: list[Coord]
+    chargers: list[Coord]
+
+    @property
+    def stations(self) -> list[Coord]:
+        return list(dict.fromkeys(self.loaders + self.dumps + self.chargers))
+
+
+@dataclass(frozen=True)
+class Job:
+    layout: str
+    N: int
+    policy: str
+    seed: int
+    steps: int
+
+    @property
+    def key(self) -> tuple:
+        return (self.layout, self.N, self.policy, self.seed)
+
+
+def load_layout(spec: dict) -> Layout:
+    # a map file, or an open room with walls around as in abomination's demo
+    if "map" in spec:
+        grid = get_grid(spec["map"])
+    else:
+        h, w = spec["size"]
+        grid = np.zeros((h, w), dtype=bool)
+        grid[1:-1, 1:-1] = True
+    cells = lambda key: [tuple(c) for c in spec[key]]
+    return Layout(grid, cells("loaders"), cells("dumps"), cells("chargers"))
+
+
+def make_jobs(sweep: dict) -> list[Job]:
+    return [
+        Job(layout, N, policy, seed, sweep["steps"])
+        for layout, N, policy, seed in itertools.product(
+            sweep["layouts"], sweep["agents"], sweep["policies"], sweep["seeds"]
+        )
+    ]
+
+
+class SharedLayouts:
+    # grid and station distance fields of every layout in shared memory,
+    # created once by the parent; workers map them read-only. if building
+    # fails partway, the blocks made so far are released
+    def __init__(self, layouts: dict[str, Layout]):
+        self.blocks: list[shared_memory.SharedMemory] = []
+        self.specs: dict[str, dict] = {}
+        try:
+            for name, layout in layouts.items():
+                self.add(name, layout)
+        except BaseException:
+            self.close()
+            raise
+
+    def add(self, name: str, layout: Layout) -> None:
+        stations = layout.stations
+        grid = self.share(layout.grid.astype(bool))
+        fields = self.share(np.stack([bfs_distances(layout.grid, c, UNREACHED) for c in stations]))
+        self.specs[name] = {
+            "grid": grid,
+            "fields": fields,
+            "stations": stations,
+            "loaders": layout.loaders,
+            "dumps": layout.dumps,
+            "chargers": layout.chargers,
+        }
+
+    def share(self, a: np.ndarray) -> tuple:
+        shm = shared_memory.SharedMemory(create=True, size=max(1, a.nbytes))
+        np.ndarray(a.shape, a.dtype, buffer=shm.buf)[...] = a
+        self.blocks.append(shm)
+        return (shm.name, a.shape, a.dtype.str)
+
+    def close(self) -> None:
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+        self.blocks = []
+
+
+# per worker process, attached shared blocks and the layouts built on them
+_blocks: list[shared_memory.SharedMemory] = []
+_layouts: dict[str, Layout] = {}
+
+
+def attach(spec: tuple) -> np.ndarray:
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    _blocks.append(shm)
+    a = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+    a.flags.writeable = False
+    return a
+
+
+def init_worker(specs: dict[str, dict]) -> None:
+    for name, spec in specs.items():
+        grid = attach(spec["grid"])
+        fields = attach(spec["fields"])
+        fp = grid_fingerprint(grid)
+        for c, field in zip(spec["stations"], fields):
+            # pinned, an evicted view would be rebuilt as a private copy
+            put_dist_table(grid, c, DistTable, DistTable(grid, c, field), fp, pin=True)
+        _layouts[name] = Layout(grid, spec["loaders"], spec["dumps"], spec["chargers"])
+
+
+def simulate(job: Job, policy: dict) -> dict:
+    layout = _layouts[job.layout]
+    rng = np.random.default_rng(job.seed)
+    free = np.argwhere(layout.grid)
+    stations = set(layout.stations)
+    free = [c for c in map(tuple, free.tolist()) if c not in stations]
+    starts = [free[k] for k in rng.choice(len(free), size=job.N, replace=False)]
+
+    t_start = time.perf_counter()
+    sim = Simulator(
+        layout.grid, starts, layout.loaders, layout.dumps, layout.chargers, seed=job.seed, **policy
+    )
+    deliveries = 0
+    served = 0  # agents taken from a station queue
+    queued = 0  # agent-steps spent in station queues
+    charging = 0  # agent-steps spent charging
+    claimed = [ev.LOADER_CLAIMED, ev.DUMP_CLAIMED, ev.CHARGER_CLAIMED]
+    for _ in range(job.steps):
+        sim.advance(1)
+        types = sim.events.pull()["type"]
+        deliveries += int(np.count_nonzero(types == ev.ARRIVED_DUMP))
+        served += int(np.count_nonzero(np.isin(types, claimed)))
+        queued += sim.L.queued + sim.D.queued + sim.C.queued
+        charging += int(np.count_nonzero(sim.agents.mode == CHARGING))
+
+    return {
+        **asdict(job),
+        "throughput": 1000 * deliveries / job.steps,
+        # Little's law, total time in queues over agents served from them
+        "queue_wait": queued / served if served > 0 else 0.0,
+        "charger_utilization": charging / (len(layout.chargers) * job.steps)
+        if len(layout.chargers) > 0
+        else 0.0,
+        "wall_time": time.perf_counter() - t_start,
+    }
+
+
+def t_quantile(df: int) -> float:
+    # two-sided 95% Student t, normal beyond 30 degrees of freedom
+    table = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365,
+             8: 2.306, 9: 2.262, 10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 30: 2.042}
+    if df > 30:
+        return 1.96
+    return table[max(k for k in table if k <= df)]
+
+
+def aggregate(rows: list[dict]) -> list[dict]:
+    # mean and 95% confidence interval over seeds, per configuration
+    groups: dict[tuple, list[dict]] = {}
+    for row in rows:
+        groups.setdefault((row["layout"], row["N"], row["policy"]), []).append(row)
+    out = []
+    for (layout, N, policy), runs in sorted(groups.items()):
+        summary = {"layout": layout, "N": N, "policy": policy, "runs": len(runs)}
+        for key in METRICS:
+            a = np.array([r[key] for r in runs], dtype=float)
+            half = t_quantile(len(a) - 1) * a.std(ddof=1) / math.sqrt(len(a)) if len(a) > 1 else math.nan
+            summary[key] = {"mean": float(a.mean()), "ci95": [float(a.mean() - half), float(a.mean() + half)]}
+        out.append(summary)
+    return out
+
+
+def load_rows(out_file: str) -> list[dict]:
+    # finished runs; a line that does not parse, the partial last one of a
+    # killed sweep, is skipped
+    if not os.path.exists(out_file):
+        return []
+    rows = []
+    with open(out_file, "r") as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                continue
+    return rows
+
+
+def run_sweep(sweep: dict, out_file: str, workers: int | None = None, resume: bool = True) -> list[dict]:
+    if resume:
+        trim_partial(out_file)
+    rows = load_rows(out_file) if resume else []
+    done = {(r["layout"], r["N"], r["policy"], r["seed"]) for r in rows}
+    todo = [job for job in make_jobs(sweep) if job.key not in done]
+
+    dirname = os.path.dirname(out_file)
+    if len(dirname) > 0:
+        os.makedirs(dirname, exist_ok=True)
+    # every layout loads before any shared memory is made
+    layouts = {name: load_layout(spec) for name, spec in sweep["layouts"].items()}
+    shared = SharedLayouts(layouts)
+    try:
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(shared.specs,)) as pool, open(
+            out_file, "a" if resume else "w"
+        ) as f:
+            futures = {
+                pool.submit(simulate, job, sweep["policies"][job.policy]): job for job in todo
+            }
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    row = future.result()
+                except Exception as e:
+                    print(f"failed {job}: {e!r}")
+                    continue
+                rows.append(row)
+                f.write(json.dumps(row) + "\n")
+                f.flush()
+    finally:
+        shared.close()
+    return aggregate(rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Monte Carlo sweep of warehouse Simulator configurations")
+    parser.add_argument(
+        "sweep",
+        help="JSON with layouts {name: {map | size, loaders, dumps, chargers}},"
+        " agents, seeds, policies {name: Simulator kwargs} and steps",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default="montecarlo.jsonl", help="per run results, JSONL")
+    parser.add_argument("--summary", default=None, help="aggregated JSON, default <out>.summary.json")
+    parser.add_argument("--no-resume", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.sweep, "r") as f:
+        sweep = json.load(f)
+    summary = run_sweep(sweep, args.out, workers=args.workers, resume=not args.no_resume)
+    for s in summary:
+        print(
+            f"{s['layout']:16s} N{s['N']:<5d} {s['policy']:12s} runs {s['runs']:3d}"
+            + "".join(
+                f"  {key} {s[key]['mean']:8.3f} [{s[key]['ci95'][0]:.3f}, {s[key]['ci95'][1]:.3f}]"
+                for key in METRICS
+            )
+        )
+    summary_file = args.summary or os.path.splitext(args.out)[0] + ".summary.json"
+    with open(summary_file, "w") as f:
+        json.dump(summary, f, indent=1)
+    print(f"results in {args.out}, summary in {summary_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,35 @@
+import json
+from typing import Iterator
+
 import numpy as np
 
+from .dist_cache import get_dist_table, grid_fingerprint
 from .dist_table import DistTable
 from .mapf_utils import Config, Configs, Coord, Grid, get_neighbors
+from .pibt_stack import funcPIBT_stack
+from .profiler import NULL_PROFILER
 
 
 class PIBT:
-    def __init__(self, grid: Grid, starts: Config, goals: Config, seed: int = 0):
+    def __init__(
+        self,
+        grid: Grid,
+        starts: Config,
+        goals: Config,
+        seed: int = 0,
+        use_stack: bool = False,
+        profiler=None,
+    ):
         self.grid = grid
         self.starts = starts
-        self.goals = goals
+        self.goals = list(goals)  # changed in place by set_goal
         self.N = len(self.starts)
 
-        # distance table
-        self.dist_tables = [DistTable(grid, goal) for goal in goals]
+        # distance table, shared through the process-wide cache
+        self.grid_fp = grid_fingerprint(grid)
+        self.dist_tables = [
+            get_dist_table(grid, goal, DistTable, self.grid_fp) for goal in goals
+        ]
 
         # cache
         self.NIL = self.N  # meaning \bot
@@ -23,13 +40,45 @@ class PIBT:
         # used for tie-breaking
         self.rng = np.random.default_rng(seed)
 
-    def funcPIBT(self, Q_from: Config, Q_to: Config, i: int) -> bool:
-        # true -> valid, false -> invalid
-
+        # priority inheritance without recursion, see pibt_stack
+        self.use_stack = use_stack
+        self.max_chain_depth = 0  # longest inheritance chain in the last step
+
+        # per-phase timing, see profiler; calls counts candidates() in a step
+        self.prof = profiler if profiler is not None else NULL_PROFILER
+        self.calls = 0
+
+        # run_iter state (priorities, t, Q) exists, see init_run and restore
+        self.running = False
+
+    def set_goal(self, i: int, goal: Coord) -> None:
+        # lifelong use: new goal for agent i, the others keep theirs; the
+        # distance table comes from the cache, the priority restarts from its
+        # fractional part as for an agent that reached its goal
+        if goal == self.goals[i]:
+            return
+        self.goals[i] = goal
+        self.dist_tables[i] = get_dist_table(self.grid, goal, DistTable, self.grid_fp)
+        if self.running:
+            self.priorities[i] -= np.floor(self.priorities[i])
+            self.done = False
+
+    def set_goals(self, mask: np.ndarray, goals: Config) -> None:
+        # goals of the agents selected by the boolean mask, in agent order
+        for i, goal in zip(np.flatnonzero(mask).tolist(), goals):
+            self.set_goal(i, goal)
+
+    def candidates(self, Q_from: Config, i: int) -> Config:
         # get candidate next vertices
+        self.calls += 1
         C = [Q_from[i]] + get_neighbors(self.grid, Q_from[i])
         self.rng.shuffle(C)  # tie-breaking, randomize
-        C = sorted(C, key=lambda u: self.dist_tables[i].get(u))
+        return sorted(C, key=lambda u: self.dist_tables[i].get(u))
+
+    def funcPIBT(self, Q_from: Config, Q_to: Config, i: int, depth: int = 1) -> bool:
+        # true -> valid, false -> invalid
+        self.max_chain_depth = max(self.max_chain_depth, depth)
+        C = self.candidates(Q_from, i)
 
         # vertex assignment
         for v in C:
@@ -51,7 +100,7 @@ class PIBT:
             if (
                 j != self.NIL
                 and (Q_to[j] == self.NIL_COORD)
-                and (not self.funcPIBT(Q_from, Q_to, j))
+                and (not self.funcPIBT(Q_from, Q_to, j, depth + 1))
             ):
                 continue
 
@@ -64,47 +113,113 @@ class PIBT:
 
     def step(self, Q_from: Config, priorities: list[float]) -> Config:
         # setup
+        m = self.prof.mark()
         N = len(Q_from)
         Q_to: Config = []
         for i, v in enumerate(Q_from):
             Q_to.append(self.NIL_COORD)
             self.occupied_now[v] = i
+        m = self.prof.lap("pibt.setup", m)
 
         # perform PIBT
+        self.max_chain_depth = 0
+        self.calls = 0
+        top = 0
         A = sorted(list(range(N)), key=lambda i: priorities[i], reverse=True)
+        m = self.prof.lap("pibt.sort", m)
         for i in A:
-            if Q_to[i] == self.NIL_COORD:
+            if Q_to[i] != self.NIL_COORD:
+                continue
+            top += 1
+            if self.use_stack:
+                _, depth = funcPIBT_stack(self, Q_from, Q_to, i)
+                self.max_chain_depth = max(self.max_chain_depth, depth)
+            else:
                 self.funcPIBT(Q_from, Q_to, i)
+        m = self.prof.lap("pibt.plan", m)
 
         # cleanup
         for q_from, q_to in zip(Q_from, Q_to):
             self.occupied_now[q_from] = self.NIL
             self.occupied_nxt[q_to] = self.NIL
+        self.prof.lap("pibt.cleanup", m)
+        self.prof.count("pibt.inheritance", self.calls - top)
+        self.prof.count("pibt.chain_depth", self.max_chain_depth)
 
         return Q_to
 
-    def run(self, max_timestep: int = 1000) -> Configs:
+    def init_run(self) -> None:
         # define priorities
-        priorities: list[float] = []
+        self.priorities: list[float] = []
         for i in range(self.N):
-            priorities.append(self.dist_tables[i].get(self.starts[i]) / self.grid.size)
+            self.priorities.append(
+                self.dist_tables[i].get(self.starts[i]) / self.grid.size
+            )
+        self.t = 0
+        self.Q = self.starts
+        self.done = False
+        self.running = True
+
+    def run_iter(self, max_timestep: int = 1000, resume: bool = False) -> Iterator[Config]:
+        # yields each configuration as soon as it is produced;
+        # with resume=True, continues from the state set by restore()
+        if not resume:
+            self.init_run()
+            yield self.Q
 
         # main loop, generate sequence of configurations
-        configs = [self.starts]
-        while len(configs) <= max_timestep:
+        while self.t < max_timestep and not self.done:
             # obtain new configuration
-            Q = self.step(configs[-1], priorities)
-            configs.append(Q)
+            start = self.prof.mark()
+            Q = self.step(self.Q, self.priorities)
 
             # update priorities & goal check
             flg_fin = True
             for i in range(self.N):
                 if Q[i] != self.goals[i]:
                     flg_fin = False
-                    priorities[i] += 1
+                    self.priorities[i] += 1
                 else:
-                    priorities[i] -= np.floor(priorities[i])
-            if flg_fin:
-                break  # goal
+                    self.priorities[i] -= np.floor(self.priorities[i])
 
-        return configs
\ No newline at end of file
+            self.t += 1
+            self.Q = Q
+            self.done = flg_fin  # goal
+            self.prof.tick(start)
+            yield Q
+
+    def run(self, max_timestep: int = 1000) -> Configs:
+        return list(self.run_iter(max_timestep))
+
+    def checkpoint(self) -> dict:
+        # solver state between two yields of run_iter, JSON-serializable
+        return {
+            "t": self.t,
+            "Q": [list(v) for v in self.Q],
+            "goals": [list(v) for v in self.goals],
+            "priorities": [float(p) for p in self.priorities],
+            "done": self.done,
+            "rng": self.rng.bit_generator.state,
+        }
+
+    def restore(self, checkpoint: dict) -> None:
+        self.t = checkpoint["t"]
+        self.Q = [tuple(v) for v in checkpoint["Q"]]
+        # goals may have changed since construction, see set_goal; checkpoints
+        # written before goals were saved keep the current ones
+        self.goals = [tuple(v) for v in checkpoint.get("goals", self.goals)]
+        self.dist_tables = [
+            get_dist_table(self.grid, goal, DistTable, self.grid_fp) for goal in self.goals
+        ]
+        self.priorities = list(checkpoint["priorities"])
+        self.done = checkpoint["done"]
+        self.rng.bit_generator.state = checkpoint["rng"]
+        self.running = True
+
+    def save_checkpoint(self, filename: str) -> None:
+        with open(filename, "w") as f:
+            json.dump(self.checkpoint(), f)
+
+    def load_checkpoint(self, filename: str) -> None:
+        with open(filename, "r") as f:
+            self.restore(json.load(f))
@@ -0,0 +1,58 @@
+from typing import Any
+
+
+def funcPIBT_stack(pibt: Any, Q_from: Any, Q_to: Any, i: int) -> tuple[bool, int]:
+    # explicit-stack version of PIBT.funcPIBT with the same semantics and RNG usage;
+    # works with any PIBT exposing candidates(), NIL, NIL_COORD and occupied_now/nxt
+    # returns (valid, maximum inheritance chain depth)
+    NIL, NIL_COORD = pibt.NIL, pibt.NIL_COORD
+    occupied_now, occupied_nxt = pibt.occupied_now, pibt.occupied_nxt
+
+    stack = [(i, iter(pibt.candidates(Q_from, i)))]
+    max_depth = 1
+    res = False  # result of the frame popped last
+    child_done = False
+    while len(stack) > 0:
+        k, C = stack[-1]
+
+        # child returned true -> this frame returns true as well
+        if child_done and res:
+            stack.pop()
+            continue
+        child_done = False
+
+        # vertex assignment
+        for v in C:
+            # avoid vertex collision
+            if occupied_nxt[v] != NIL:
+                continue
+
+            j = int(occupied_now[v])
+
+            # avoid edge collision
+            if j != NIL and Q_to[j] == Q_from[k]:
+                continue
+
+            # reserve next location
+            Q_to[k] = v
+            occupied_nxt[v] = k
+
+            # priority inheritance, resumes this frame once j is done
+            if j != NIL and Q_to[j] == NIL_COORD:
+                stack.append((j, iter(pibt.candidates(Q_from, j))))
+                max_depth = max(max_depth, len(stack))
+                break
+
+            res = True
+            child_done = True
+            stack.pop()
+            break
+        else:
+            # failed to secure node
+            Q_to[k] = Q_from[k]
+            occupied_nxt[Q_from[k]] = k
+            res = False
+            child_done = True
+            stack.pop()
+
+    return res, max_depth
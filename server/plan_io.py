@@ -0,0 +1,168 @@
+import os
+import re
+import struct
+from dataclasses import dataclass
+
+import numpy as np
+
+from .mapf_utils import Config
+
+# little-endian header: magic, version, itemsize, N, T, height, width, padding
+MAGIC = b"MAPFPLN\0"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIIII4x")
+assert HEADER.size == 32
+
+
+@dataclass
+class PlanHeader:
+    N: int
+    T: int
+    height: int
+    width: int
+    itemsize: int
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype("<i2") if self.itemsize == 2 else np.dtype("<i4")
+
+
+def plan_dtype(height: int, width: int) -> np.dtype:
+    # flat cell ids v = y * width + x, int16 whenever they fit
+    return np.dtype("<i2") if height * width <= np.iinfo(np.int16).max else np.dtype("<i4")
+
+
+def read_header(filename: str) -> PlanHeader:
+    with open(filename, "rb") as f:
+        magic, version, itemsize, N, T, height, width = HEADER.unpack(
+            f.read(HEADER.size)
+        )
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{filename} is not a binary plan file")
+    header = PlanHeader(N, T, height, width, itemsize)
+
+    # trust the file size over T, the writer may not have been closed
+    if N > 0:
+        header.T = (os.path.getsize(filename) - HEADER.size) // (N * itemsize)
+    return header
+
+
+class PlanWriter:
+    def __init__(self, filename: str, N: int, height: int, width: int):
+        dirname = os.path.dirname(filename)
+        if len(dirname) > 0:
+            os.makedirs(dirname, exist_ok=True)
+        self.N = N
+        self.height = height
+        self.width = width
+        self.dtype = plan_dtype(height, width)
+        self.T = 0
+        self.f = open(filename, "wb")
+        self.write_header()
+
+    def write_header(self) -> None:
+        pos = self.f.tell()
+        self.f.seek(0)
+        self.f.write(
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                self.dtype.itemsize,
+                self.N,
+                self.T,
+                self.height,
+                self.width,
+            )
+        )
+        if pos > 0:
+            self.f.seek(pos)
+
+    def append(self, config: Config | np.ndarray) -> None:
+        # accepts flat ids (N,) or (y, x) coords (N, 2)
+        a = np.asarray(config)
+        if a.ndim == 2:
+            a = a[:, 0] * self.width + a[:, 1]
+        if a.shape != (self.N,):
+            raise ValueError(f"expected {self.N} agents, got {a.shape}")
+        self.f.write(a.astype(self.dtype).tobytes())
+        self.T += 1
+
+    def extend(self, configs) -> None:
+        for config in configs:
+            self.append(config)
+
+    def flush(self) -> None:
+        self.write_header()
+        self.f.flush()
+
+    def close(self) -> None:
+        if not self.f.closed:
+            self.flush()
+            self.f.close()
+
+    def __enter__(self) -> "PlanWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class PlanReader:
+    # random access to any timestep through np.memmap, nothing is parsed upfront
+    def __init__(self, filename: str):
+        self.header = read_header(filename)
+        h = self.header
+        if h.T == 0 or h.N == 0:
+            # np.memmap cannot map an empty region
+            self.plan = np.zeros((h.T, h.N), dtype=h.dtype)
+            return
+        self.plan = np.memmap(
+            filename,
+            dtype=h.dtype,
+            mode="r",
+            offset=HEADER.size,
+            shape=(h.T, h.N),
+        )
+
+    def __len__(self) -> int:
+        return self.header.T
+
+    def __getitem__(self, t):
+        return self.plan[t]
+
+    def config(self, t: int) -> Config:
+        return [divmod(v, self.header.width) for v in self.plan[t].tolist()]
+
+
+def save_plan(configs, filename: str, height: int, width: int) -> None:
+    with PlanWriter(filename, len(configs[0]), height, width) as w:
+        w.extend(configs)
+
+
+def text_to_plan(text_file: str, plan_file: str, height: int, width: int) -> None:
+    # converts the visualizer format "t:(x,y),(x,y),..." line by line
+    pattern = re.compile(r"\((-?\d+),(-?\d+)")
+    writer = None
+    with open(text_file, "r") as f:
+        for line in f:
+            xy = np.array(pattern.findall(line), dtype=np.int64).reshape(-1, 2)
+            if len(xy) == 0:
+                continue
+            if writer is None:
+                writer = PlanWriter(plan_file, len(xy), height, width)
+            writer.append(xy[:, 1] * width + xy[:, 0])
+    if writer is None:
+        raise ValueError(f"{text_file} has no configurations")
+    writer.close()
+
+
+def plan_to_text(plan_file: str, text_file: str, chunk: int = 1024) -> None:
+    reader = PlanReader(plan_file)
+    W = reader.header.width
+    with open(text_file, "w") as f:
+        for t0 in range(0, len(reader), chunk):
+            block = np.asarray(reader[t0 : t0 + chunk])
+            ys, xs = block // W, block % W
+            for k, (y, x) in enumerate(zip(ys.tolist(), xs.tolist())):
+                row = f"{t0 + k}:" + "".join([f"({a},{b})," for a, b in zip(x, y)])
+                f.write(row + "\n")
@@ -0,0 +1,116 @@
+import sys
+import time
+from typing import TextIO
+
+import numpy as np
+
+
+class PhaseProfiler:
+    # per-phase wall times and per-tick counters over the last window ticks;
+    # phases are timed between marks so that nested sections (PIBT inside a
+    # simulator tick) do not interfere:
+    #   m = prof.mark(); ...; m = prof.lap("phase", m); ...; prof.tick(start)
+    enabled = True
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.ticks = 0
+        self.rings: dict[str, np.ndarray] = {}  # phase or counter -> last values
+        self.written: dict[str, int] = {}
+        self.phases: dict[str, float] = {}  # times within the running tick
+        self.counters: dict[str, int] = {}
+        self.phase_names: dict[str, None] = {}
+        self.counter_names: dict[str, None] = {}
+
+    def mark(self) -> float:
+        return time.perf_counter()
+
+    def lap(self, phase: str, mark: float) -> float:
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - mark
+        return now
+
+    def count(self, name: str, k: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + k
+
+    def push(self, name: str, value: float) -> None:
+        ring = self.rings.get(name)
+        if ring is None:
+            ring = np.zeros(self.window)
+            self.rings[name] = ring
+        n = self.written.get(name, 0)
+        ring[n % self.window] = value
+        self.written[name] = n + 1
+
+    def tick(self, start: float) -> None:
+        self.phases["tick"] = time.perf_counter() - start
+        self.phase_names.update(dict.fromkeys(self.phases))
+        self.counter_names.update(dict.fromkeys(self.counters))
+        # phases and counters seen before but not in this tick count as zero
+        for phase in self.phase_names:
+            self.push(phase, self.phases.get(phase, 0.0))
+        for name in self.counter_names:
+            self.push(name, self.counters.get(name, 0))
+        self.phases = {}
+        self.counters = {}
+        self.ticks += 1
+
+    def recent(self, name: str) -> np.ndarray:
+        return self.rings[name][: min(self.written[name], self.window)]
+
+    def histogram(self, phase: str, bins: int = 12) -> dict:
+        # log-spaced bins from 1 us to 1 s
+        edges = np.logspace(-6, 0, bins + 1)
+        counts, _ = np.histogram(np.clip(self.recent(phase), edges[0], edges[-1]), bins=edges)
+        return {"edges_s": edges.tolist(), "counts": counts.tolist()}
+
+    def summary(self) -> dict:
+        total = self.recent("tick").sum() if "tick" in self.rings else 0.0
+        phases = {}
+        for phase in self.phase_names:
+            a = self.recent(phase) * 1e3
+            phases[phase] = {
+                "mean_ms": float(a.mean()),
+                "p50_ms": float(np.percentile(a, 50)),
+                "p90_ms": float(np.percentile(a, 90)),
+                "p99_ms": float(np.percentile(a, 99)),
+                "max_ms": float(a.max()),
+                "share": float(a.sum() / 1e3 / total) if total > 0 else 0.0,
+            }
+        counters = {}
+        for name in self.counter_names:
+            a = self.recent(name)
+            counters[name] = {"mean": float(a.mean()), "max": float(a.max()), "total": float(a.sum())}
+        return {"ticks": self.ticks, "window": self.window, "phases": phases, "counters": counters}
+
+    def dump(self, f: TextIO = sys.stdout) -> None:
+        s = self.summary()
+        print(f"last {min(s['ticks'], s['window'])} of {s['ticks']} ticks", file=f)
+        for phase, p in sorted(s["phases"].items(), key=lambda x: -x[1]["mean_ms"]):
+            print(
+                f"  {phase:20s} mean {p['mean_ms']:9.3f} ms  p50 {p['p50_ms']:9.3f}"
+                f"  p99 {p['p99_ms']:9.3f}  max {p['max_ms']:9.3f}  {100 * p['share']:5.1f}%",
+                file=f,
+            )
+        for name, c in sorted(s["counters"].items()):
+            print(f"  {name:20s} mean {c['mean']:9.1f} /tick  max {c['max']:9.0f}", file=f)
+
+
+class NullProfiler:
+    # the disabled profiler, every call is a no-op
+    enabled = False
+
+    def mark(self) -> float:
+        return 0.0
+
+    def lap(self, phase: str, mark: float) -> float:
+        return 0.0
+
+    def count(self, name: str, k: int = 1) -> None:
+        pass
+
+    def tick(self, start: float) -> None:
+        pass
+
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,160 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Optional
+
+
+class FixedStepClock:
+    # fixed-timestep simulation clock: step(dt) runs once per dt of wall time,
+    # and when the loop falls behind (a slow step, a busy event loop) the
+    # missed steps run back to back, so simulated time is ticks * dt whatever
+    # the wall clock did. the clock only keeps time; FairScheduler drives it
+    # and decides when a backlog is dropped and counted instead
+    def __init__(self, dt: float, step: Callable[[float], None], window: int = 1000):
+        self.dt = dt
+        self.step = step
+        self.ticks = 0
+        self.skipped = 0
+        self.lags: deque[float] = deque(maxlen=window)  # how late each tick started, s
+        self.next_t = None
+
+    def due(self, t: float) -> bool:
+        if self.next_t is None:
+            self.next_t = t
+        return t >= self.next_t
+
+    def tick(self, t: float) -> None:
+        self.lags.append(t - self.next_t)
+        self.step(self.dt)
+        self.ticks += 1
+        self.next_t += self.dt
+
+    def drop_backlog(self, t: float) -> None:
+        # skip what is left of a backlog but the current step
+        if self.next_t is not None and t >= self.next_t + self.dt:
+            behind = int((t - self.next_t) // self.dt)
+            self.skipped += behind
+            self.next_t += behind * self.dt
+
+    @property
+    def sim_time(self) -> float:
+        return self.ticks * self.dt
+
+    def stats(self) -> dict:
+        lags = list(self.lags)
+        return {
+            "ticks": self.ticks,
+            "simTime": self.sim_time,
+            "dt": self.dt,
+            "skippedTicks": self.skipped,
+            "tickLagMs": {
+                "last": 1e3 * lags[-1] if lags else 0.0,
+                "mean": 1e3 * sum(lags) / len(lags) if lags else 0.0,
+                "max": 1e3 * max(lags) if lags else 0.0,
+            },
+        }
+
+
+class FairScheduler:
+    # steps many clocks on one thread in rounds: each round gives every clock
+    # that is due one step, so a session with many or slow steps cannot take
+    # the turns of the others; between rounds the event loop gets to run.
+    # a clock still behind after max_catchup rounds drops its backlog. a
+    # clock whose step raises is removed and handed to on_error(key, e), so
+    # the others keep running; without on_error the exception propagates
+    def __init__(
+        self,
+        max_catchup: int = 25,
+        idle: float = 0.05,
+        now: Callable[[], float] = time.perf_counter,
+        on_error: Optional[Callable[[Any, Exception], None]] = None,
+    ):
+        self.clocks: dict[Any, FixedStepClock] = {}
+        self.max_catchup = max_catchup
+        self.idle = idle
+        self.now = now
+        self.on_error = on_error
+
+    def add(self, key: Any, clock: FixedStepClock) -> None:
+        clock.due(self.now())  # first step due now
+        self.clocks[key] = clock
+
+    def remove(self, key: Any) -> None:
+        self.clocks.pop(key, None)
+
+    def run_round(self) -> bool:
+        ran = False
+        for key, clock in list(self.clocks.items()):
+            t = self.now()
+            if clock.due(t):
+                try:
+                    clock.tick(t)
+                except Exception as e:
+                    if self.on_error is None:
+                        raise
+                    self.remove(key)
+                    self.on_error(key, e)
+                ran = True
+        return ran
+
+    def finish_rounds(self) -> float:
+        # after the rounds of a wake-up, seconds until the next clock is due
+        t = self.now()
+        for clock in self.clocks.values():
+            clock.drop_backlog(t)
+        if not self.clocks:
+            return self.idle
+        return max(0.0, min(c.next_t for c in self.clocks.values()) - t)
+
+    async def run(self) -> None:
+        while True:
+            for _ in range(self.max_catchup):
+                if not self.run_round():
+                    break
+                await asyncio.sleep(0)
+            await asyncio.sleep(self.finish_rounds())
+
+    def run_blocking(self, poll: Callable[[float], bool]) -> None:
+        # same, for a process without an event loop; poll(timeout) waits for
+        # and handles outside work such as commands, False to stop
+        while True:
+            for _ in range(self.max_catchup):
+                if not self.run_round():
+                    break
+                if not poll(0.0):
+                    return
+            if not poll(self.finish_rounds()):
+                return
+
+
+class LatestSlot:
+    # one pending payload per client: a newer frame replaces an unsent one, so
+    # a slow consumer drops frames instead of queueing them. since frames are
+    # deltas, a replaced frame marks the slot stale and the sender sends a
+    # keyframe of the latest state instead
+    def __init__(self):
+        self.value: Any = None
+        self.stale = False
+        self.sent = 0
+        self.dropped = 0
+        self.ready = asyncio.Event()
+
+    def put(self, value: Any) -> None:
+        if self.value is not None:
+            self.dropped += 1
+            self.stale = True
+        self.value = value
+        self.ready.set()
+
+    def request_keyframe(self) -> None:
+        self.stale = True
+        self.ready.set()
+
+    async def get(self) -> tuple[Any, bool]:
+        # (latest payload or None, whether a keyframe is needed instead)
+        await self.ready.wait()
+        self.ready.clear()
+        value, stale = self.value, self.stale
+        self.value, self.stale = None, False
+        self.sent += 1
+        return value, stale
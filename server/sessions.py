@@ -0,0 +1,496 @@
+import asyncio
+import math
+import multiprocessing as mp
+import queue
+import uuid
+from dataclasses import asdict, dataclass, field, fields
+from pathlib import Path
+from typing import Optional
+
+from .destination_bin import DestinationBin
+from .hivemind import Hivemind
+from .map_reader import get_grid
+from .realtime import FairScheduler, FixedStepClock, LatestSlot
+from .robot import AbsolutePose, GridPose, Orientation, Position, Robot
+from .shared_state import PoseBuffer
+from .state_stream import FORMATS, StateStream, robot_pose
+
+MAPS_DIR = Path(__file__).resolve().parents[1] / "public" / "maps"
+EVENTS = {"json": "state_patch", "binary": "state_frame"}
+
+
+@dataclass
+class SessionConfig:
+    map: str = "sorter-20x14.map"  # file name under public/maps
+    robots: list[dict] = field(
+        default_factory=lambda: [{"id": "r1", "x": 3, "y": 10}, {"id": "r2", "x": 1, "y": 10}]
+    )
+    bins: list[dict] = field(
+        default_factory=lambda: [{"id": 1, "x": 8, "y": 10}, {"id": 2, "x": 6, "y": 10}]
+    )
+    base: Optional[list[int]] = None  # [x, y], the first robot's start if None
+    seed: int = 0
+    sim_dt: float = 0.01
+    broadcast_dt: float = 0.01
+    worker: Optional[int] = None  # worker process to run in, None for the server process
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "SessionConfig":
+        unknown = set(d) - {f.name for f in fields(cls)}
+        if unknown:
+            raise ValueError(f"unknown session settings {sorted(unknown)}")
+        config = cls(**d)
+        for name in ("sim_dt", "broadcast_dt"):
+            dt = getattr(config, name)
+            # a zero step would divide by zero in the clock, or spin the broadcast
+            if isinstance(dt, bool) or not isinstance(dt, (int, float)) or not 0 < dt < math.inf:
+                raise ValueError(f"{name} must be a positive number, got {dt!r}")
+        id_types = {"robot": (str, "a string"), "bin": (int, "an integer")}
+        for kind, entries in (("robot", config.robots), ("bin", config.bins)):
+            id_type, id_name = id_types[kind]
+            ids = set()
+            for entry in entries:
+                if not isinstance(entry, dict):
+                    raise ValueError(f"{kind} {entry!r} is not an object")
+                missing = {"id", "x", "y"} - set(entry)
+                if missing:
+                    raise ValueError(f"{kind} {entry!r} is missing {sorted(missing)}")
+                if any(isinstance(entry[k], bool) or not isinstance(entry[k], int) for k in ("x", "y")):
+                    raise ValueError(f"{kind} {entry!r} needs integer x and y")
+                if isinstance(entry["id"], bool) or not isinstance(entry["id"], id_type):
+                    raise ValueError(f"{kind} id {entry['id']!r} is not {id_name}")
+                if entry["id"] in ids:
+                    raise ValueError(f"{kind} id {entry['id']!r} is used twice")
+                ids.add(entry["id"])
+        if not (MAPS_DIR / Path(config.map).name).is_file():
+            raise ValueError(f"no map {config.map}")
+        if len(config.robots) == 0 and config.base is None:
+            raise ValueError("a session without robots needs a base")
+        return config
+
+
+class SessionSim:
+    # map, fleet, dispatcher and clock of one session. in a pinned session
+    # the worker steps its own copy and the server's is only updated from it
+    def __init__(self, config: SessionConfig):
+        cell = Robot.config.cell_size_m
+        self.grid = get_grid(str(MAPS_DIR / Path(config.map).name))
+        self.robots: dict[str, Robot] = {
+            r["id"]: Robot(
+                Position.from_grid(GridPose(r["x"], r["y"], Orientation(r.get("rotation", 0))), cell)
+            )
+            for r in config.robots
+        }
+        obs = set(map(tuple, self.grid["obstacles"]))
+
+        def blocked(nx: int, ny: int) -> bool:
+            if nx < 0 or ny < 0 or nx >= self.grid["width"] or ny >= self.grid["height"]:
+                return True
+            return (nx, ny) in obs
+
+        self.blocked = blocked
+        if config.base is not None:
+            self.base_xy = tuple(config.base)
+        else:
+            self.base_xy = (config.robots[0]["x"], config.robots[0]["y"])
+        self.bins = [DestinationBin(b["id"], b["x"], b["y"], b.get("capacity", 10)) for b in config.bins]
+        self.hivemind = Hivemind(self.robots, self.grid, blocked, self.base_xy, self.bins, seed=config.seed)
+        self.clock = FixedStepClock(config.sim_dt, self.step)
+
+    def step(self, dt: float) -> None:
+        for r in self.robots.values():
+            r.update(dt)
+        self.hivemind.step()
+
+    def move_to(self, rid: str, x: int, y: int) -> bool:
+        return self.robots[rid].move_to(x, y, self.grid["width"], self.grid["height"], self.blocked)
+
+
+class Session:
+    # one simulation and the clients watching it, in socket.io room
+    # session:<id>; each client has a latest-wins slot and a sender task
+    def __init__(self, session_id: str, config: SessionConfig, sio):
+        self.id = session_id
+        self.config = config
+        self.sio = sio
+        self.room = f"session:{session_id}"
+        self.sim = SessionSim(config)
+        self.stream = StateStream(
+            self.sim.grid, Robot.config.cell_size_m, self.sim.base_xy, self.sim.robots, self.sim.bins
+        )
+        self.formats: dict[str, str] = {}
+        self.slots: dict[str, LatestSlot] = {}
+        self.senders: dict[str, asyncio.Task] = {}
+        # pinned session: poses from the worker, commands to it, its clock stats
+        self.poses: Optional[PoseBuffer] = None
+        self.commands = None
+        self.clock_stats: dict = {}
+        self.command_errors = 0
+        self.last_command_error: Optional[str] = None
+        self.broadcaster: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.broadcaster = asyncio.create_task(self.broadcast_loop())
+
+    async def broadcast_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_t = loop.time()
+        while True:
+            if self.poses is not None:
+                self.sync()
+            frame = self.stream.next_frame()
+            payloads = {
+                fmt: self.stream.encode(frame, fmt) for fmt in FORMATS if fmt in self.formats.values()
+            }
+            for sid, slot in self.slots.items():
+                slot.put(payloads[self.formats[sid]])
+            next_t = max(next_t + self.config.broadcast_dt, loop.time())
+            await asyncio.sleep(next_t - loop.time())
+
+    def sync(self) -> None:
+        # latest poses the worker wrote, without waiting on it
+        snapshot = self.poses.read()
+        if snapshot is None:
+            return
+        _, poses = snapshot
+        for r, (x, y, rotation, ax, ay, deg) in zip(self.sim.robots.values(), poses.tolist()):
+            grid = r.position.grid
+            if (grid.x, grid.y, int(grid.rotation)) != (x, y, rotation):
+                grid = GridPose(int(x), int(y), Orientation(int(rotation)))
+            r.position = Position(grid, AbsolutePose(ax, ay, deg))
+
+    def move_to(self, rid: str, x: int, y: int) -> None:
+        if rid not in self.sim.robots:
+            return
+        if self.commands is None:
+            self.sim.move_to(rid, x, y)
+        else:
+            self.commands.put(("move_to", self.id, rid, x, y))
+
+    async def sender(self, sid: str) -> None:
+        slot, fmt = self.slots[sid], self.formats[sid]
+        while True:
+            payload, stale = await slot.get()
+            if stale:
+                # the stream has not moved since get(), the keyframe is the latest frame
+                payload = self.stream.encode(self.stream.keyframe(), fmt)
+            await self.sio.emit(EVENTS[fmt], payload, to=sid)
+
+    async def join(self, sid: str, fmt: str) -> None:
+        self.formats[sid] = fmt
+        await self.sio.enter_room(sid, self.room)
+        await self.sio.emit(
+            "static_state", {**self.stream.static_state(), "format": fmt, "session": self.id}, to=sid
+        )
+        self.slots[sid] = LatestSlot()
+        self.slots[sid].request_keyframe()
+        self.senders[sid] = asyncio.create_task(self.sender(sid))
+
+    async def leave(self, sid: str) -> None:
+        task = self.senders.pop(sid, None)
+        if task is not None:
+            task.cancel()
+        self.slots.pop(sid, None)
+        self.formats.pop(sid, None)
+        await self.sio.leave_room(sid, self.room)
+
+    def request_keyframe(self, sid: str) -> None:
+        if sid in self.slots:
+            self.slots[sid].request_keyframe()
+
+    async def close(self, reason: Optional[str] = None) -> None:
+        msg = {"session": self.id} if reason is None else {"session": self.id, "reason": reason}
+        await self.sio.emit("session_closed", msg, room=self.room)
+        for sid in list(self.formats):
+            await self.leave(sid)
+        if self.broadcaster is not None:
+            self.broadcaster.cancel()
+        if self.poses is not None:
+            self.poses.close(unlink=True)
+
+    def stats(self) -> dict:
+        clock = self.sim.clock.stats() if self.config.worker is None else self.clock_stats
+        return {
+            "id": self.id,
+            "map": self.config.map,
+            "robots": len(self.sim.robots),
+            "worker": self.config.worker,
+            **clock,
+            "commandErrors": self.command_errors,
+            "lastCommandError": self.last_command_error,
+            "clients": {
+                sid: {"format": self.formats[sid], "sent": slot.sent, "dropped": slot.dropped}
+                for sid, slot in self.slots.items()
+            },
+        }
+
+
+class SessionManager:
+    # sessions by id and which one each client watches. sessions in the server
+    # process share a FairScheduler; a session pinned to worker k runs in
+    # worker process k, which writes poses to a shared PoseBuffer every tick
+    # and sends paths, bin items and stats over a queue when they change;
+    # commands go to the worker over another queue. a session that fails in
+    # its worker, or whose worker exits, is closed and kept in failed
+    def __init__(self, sio, workers: int = 0):
+        self.sio = sio
+        self.sessions: dict[str, Session] = {}
+        self.failed: dict[str, str] = {}  # session id: why
+        self.client_session: dict[str, str] = {}
+        self.scheduler = FairScheduler(on_error=self.step_failed)
+        self.n_workers = workers
+        self.workers: list[WorkerHandle] = []
+        self.tasks: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self.tasks.append(asyncio.create_task(self.scheduler.run()))
+        ctx = mp.get_context("spawn")
+        for k in range(self.n_workers):
+            w = WorkerHandle(ctx, k)
+            self.workers.append(w)
+            self.tasks.append(asyncio.create_task(self.read_worker(w)))
+
+    async def stop(self) -> None:
+        for session_id in list(self.sessions):
+            await self.destroy(session_id)
+        for w in self.workers:
+            w.stop()
+        for task in self.tasks:
+            task.cancel()
+
+    async def create(self, config: SessionConfig, session_id: Optional[str] = None) -> Session:
+        session_id = session_id or uuid.uuid4().hex[:8]
+        if session_id in self.sessions:
+            raise ValueError(f"session {session_id} exists")
+        if config.worker is not None and not 0 <= config.worker < len(self.workers):
+            raise ValueError(f"no worker {config.worker}, the server has {len(self.workers)}")
+        if config.worker is not None and not self.workers[config.worker].process.is_alive():
+            raise ValueError(f"worker {config.worker} has exited")
+        session = Session(session_id, config, self.sio)
+        self.sessions[session_id] = session
+        if config.worker is None:
+            self.scheduler.add(session_id, session.sim.clock)
+        else:
+            w = self.workers[config.worker]
+            session.poses = PoseBuffer(len(session.sim.robots))
+            session.commands = w.commands
+            w.commands.put(("create", session_id, asdict(config), session.poses.name))
+        session.start()
+        return session
+
+    async def destroy(self, session_id: str, reason: Optional[str] = None) -> None:
+        # with a reason the session failed, and is already gone from its
+        # scheduler or worker
+        session = self.sessions.pop(session_id)
+        if session.config.worker is None:
+            self.scheduler.remove(session_id)
+        elif reason is None:
+            self.workers[session.config.worker].commands.put(("destroy", session_id))
+        if reason is not None:
+            self.failed[session_id] = reason
+        for sid in list(session.formats):
+            self.client_session.pop(sid, None)
+        await session.close(reason)
+
+    async def join(self, sid: str, session_id: str, fmt: str) -> None:
+        if session_id not in self.sessions:
+            raise KeyError(session_id)
+        await self.leave(sid)
+        self.client_session[sid] = session_id
+        await self.sessions[session_id].join(sid, fmt)
+
+    async def leave(self, sid: str) -> None:
+        session_id = self.client_session.pop(sid, None)
+        if session_id in self.sessions:
+            await self.sessions[session_id].leave(sid)
+
+    def step_failed(self, session_id: str, e: Exception) -> None:
+        # from the scheduler, which has dropped the session's clock already
+        async def fail() -> None:
+            if session_id in self.sessions:
+                await self.destroy(session_id, f"step failed: {e!r}")
+
+        self.tasks.append(asyncio.create_task(fail()))
+
+    def session_of(self, sid: str) -> Optional[Session]:
+        return self.sessions.get(self.client_session.get(sid))
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self.workers),
+            "sessions": [s.stats() for s in self.sessions.values()],
+            "failed": dict(self.failed),
+        }
+
+    async def read_worker(self, w: "WorkerHandle") -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                msg = await loop.run_in_executor(None, w.out.get, True, w.poll_s)
+            except queue.Empty:
+                if w.process.is_alive():
+                    continue
+                # nothing left from a worker that is gone
+                reason = f"worker {w.index} exited with code {w.process.exitcode}"
+                for session_id, session in list(self.sessions.items()):
+                    if session.config.worker == w.index:
+                        await self.destroy(session_id, reason)
+                return
+            if msg is None:
+                return
+            kind, session_id, *rest = msg
+            session = self.sessions.get(session_id)
+            if session is None:
+                continue
+            if kind == "changes":
+                apply_changes(session, *rest)
+            elif kind == "command_error":
+                # commands to a worker are not awaited, so nobody to raise to
+                session.command_errors += 1
+                session.last_command_error = rest[0]
+            elif kind == "error":
+                await self.destroy(session_id, *rest)
+
+
+# worker processes
+
+
+class WorkerHandle:
+    poll_s = 1.0  # how often read_worker checks that the process is alive
+
+    def __init__(self, ctx, index: int):
+        self.index = index
+        self.commands = ctx.Queue()
+        self.out = ctx.Queue()
+        self.process = ctx.Process(target=worker_main, args=(self.commands, self.out), daemon=True)
+        self.process.start()
+
+    def stop(self) -> None:
+        self.commands.put(("stop",))
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.out.put(None)  # ends read_worker
+
+
+class Publisher:
+    # a session in a worker: steps it, writes the poses to the shared buffer
+    # after every step, and every dt sends the paths and bin items that
+    # changed, and every second the clock stats, to the server
+    stats_every = 1.0
+
+    def __init__(self, session_id: str, sim: SessionSim, dt: float, buffer_name: str, out):
+        self.id = session_id
+        self.sim = sim
+        self.dt = dt
+        self.out = out
+        self.poses = PoseBuffer(len(sim.robots), buffer_name)
+        self.ticks = 0
+        self.next_t = 0.0
+        self.next_stats = 0.0
+        self.sent_paths: dict[str, Optional[list]] = {}
+        self.sent_items: dict[int, tuple] = {}
+        self.error: Optional[str] = None  # why stepping failed, the session stops then
+        sim.clock.step = self.step
+
+    def step(self, dt: float) -> None:
+        if self.error is not None:
+            return
+        try:
+            self.sim.step(dt)
+        except Exception as e:
+            self.error = f"step failed: {e!r}"
+            return
+        self.ticks += 1
+        self.poses.write(self.ticks, [robot_pose(r) for r in self.sim.robots.values()])
+
+    def publish(self, t: float) -> None:
+        if t < self.next_t:
+            return
+        self.next_t = t + self.dt
+        paths = {}
+        for rid, r in self.sim.robots.items():
+            if rid not in self.sent_paths or r.path is not self.sent_paths[rid]:
+                paths[rid] = r.path
+                self.sent_paths[rid] = r.path
+        items = {}
+        for b in self.sim.bins:
+            items_now = tuple(b.items)
+            if items_now != self.sent_items.get(b.id):
+                items[b.id] = list(items_now)
+                self.sent_items[b.id] = items_now
+        stats = None
+        if t >= self.next_stats:
+            self.next_stats = t + self.stats_every
+            stats = self.sim.clock.stats()
+        if paths or items or stats is not None:
+            self.out.put(("changes", self.id, paths, items, stats))
+
+    def close(self) -> None:
+        self.poses.close()
+
+
+def apply_changes(session: Session, paths: dict, items: dict, stats: Optional[dict]) -> None:
+    for rid, path in paths.items():
+        session.sim.robots[rid].path = path
+    bins = {b.id: b for b in session.sim.bins}
+    for k, v in items.items():
+        bins[k].clean_items(v)
+    if stats is not None:
+        session.clock_stats = stats
+
+
+def worker_main(commands, out) -> None:
+    # sessions pinned to this worker, stepped by a FairScheduler between commands
+    publishers: dict[str, Publisher] = {}
+    scheduler = FairScheduler()
+
+    def drop(session_id: str) -> None:
+        scheduler.remove(session_id)
+        p = publishers.pop(session_id, None)
+        if p is not None:
+            p.close()
+
+    def poll(timeout: float) -> bool:
+        t = scheduler.now()
+        for session_id, p in list(publishers.items()):
+            if p.error is not None:
+                # one failing session should not take the others down with it
+                out.put(("error", session_id, p.error))
+                drop(session_id)
+            else:
+                p.publish(t)
+        if publishers:
+            timeout = min(timeout, max(0.0, min(p.next_t for p in publishers.values()) - t))
+        try:
+            cmd = commands.get(timeout=timeout) if timeout > 0 else commands.get_nowait()
+        except queue.Empty:
+            return True
+        if cmd[0] == "stop":
+            for p in publishers.values():
+                p.close()
+            return False
+        if cmd[0] == "create":
+            _, session_id, config, buffer_name = cmd
+            try:
+                config = SessionConfig(**config)
+                sim = SessionSim(config)
+                publishers[session_id] = Publisher(session_id, sim, config.broadcast_dt, buffer_name, out)
+            except Exception as e:
+                out.put(("error", session_id, f"create failed: {e!r}"))
+                return True
+            scheduler.add(session_id, sim.clock)
+        elif cmd[0] == "destroy":
+            _, session_id = cmd
+            drop(session_id)
+        elif cmd[0] == "move_to":
+            _, session_id, rid, x, y = cmd
+            if session_id in publishers:
+                try:
+                    publishers[session_id].sim.move_to(rid, x, y)
+                except Exception as e:
+                    # a bad command leaves the session running
+                    out.put(("command_error", session_id, f"move_to failed: {e!r}"))
+        return True
+
+    scheduler.run_blocking(poll)
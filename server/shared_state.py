@@ -0,0 +1,69 @@
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+# per robot: grid x, y, rotation, absolute x, y, heading
+POSE_FIELDS = 6
+
+
+class PoseBuffer:
+    # robot poses of one session in shared memory, written by the process that
+    # steps it and read by the server. two slots: the writer fills the one that
+    # is not latest, then flips latest, so a reader always finds a complete
+    # snapshot without waiting on the writer. each slot's sequence number is
+    # odd while it is written (a seqlock) in case the writer laps a slow reader
+    #   [latest] [seq, tick, poses (n x 6 float64)] [seq, tick, poses]
+    def __init__(self, n_robots: int, name: Optional[str] = None):
+        self.n = n_robots
+        slot = 16 + 8 * POSE_FIELDS * n_robots
+        create = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=8 + 2 * slot if create else 0)
+        buf = self.shm.buf
+        self.latest = np.ndarray((1,), np.int64, buf, 0)
+        self.seq = [np.ndarray((1,), np.int64, buf, 8 + k * slot) for k in range(2)]
+        self.ticks = [np.ndarray((1,), np.int64, buf, 16 + k * slot) for k in range(2)]
+        self.poses = [
+            np.ndarray((n_robots, POSE_FIELDS), np.float64, buf, 24 + k * slot) for k in range(2)
+        ]
+        if create:
+            self.latest[0] = 0
+            for k in range(2):
+                self.seq[k][0] = 0
+                self.ticks[k][0] = -1  # nothing written yet
+        self.last_read = -1
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def write(self, tick: int, poses) -> None:
+        k = 1 - int(self.latest[0])
+        self.seq[k][0] += 1
+        self.poses[k][...] = poses
+        self.ticks[k][0] = tick
+        self.seq[k][0] += 1
+        self.latest[0] = k
+
+    def read(self, retries: int = 8) -> Optional[tuple[int, np.ndarray]]:
+        # (tick, poses) of the latest snapshot if newer than the last read
+        for _ in range(retries):
+            k = int(self.latest[0])
+            s = int(self.seq[k][0])
+            if s % 2 == 1:
+                continue
+            tick = int(self.ticks[k][0])
+            poses = self.poses[k].copy()
+            if int(self.seq[k][0]) == s:
+                if tick <= self.last_read:
+                    return None
+                self.last_read = tick
+                return tick, poses
+        return None
+
+    def close(self, unlink: bool = False) -> None:
+        # views into the buffer have to go before it can be closed
+        self.latest = self.seq = self.ticks = self.poses = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
@@ -0,0 +1,78 @@
+import random
+import struct
+
+import numpy as np
+
+# little-endian header: magic, version, padding, t, N, loaders, dumps, chargers;
+# then length-prefixed arrays in the order the simulator writes them
+MAGIC = b"SIMSNAP\0"
+VERSION = 1
+HEADER = struct.Struct("<8sH6xqIIII")
+assert HEADER.size == 40
+LENGTH = struct.Struct("<Q")
+PCG64_STATE = struct.Struct("<16s16sII")
+
+
+class SnapshotWriter:
+    def __init__(self, t: int, N: int, n_loaders: int, n_dumps: int, n_chargers: int):
+        self.parts = [HEADER.pack(MAGIC, VERSION, t, N, n_loaders, n_dumps, n_chargers)]
+
+    def array(self, a, dtype) -> None:
+        a = np.ascontiguousarray(a, dtype=dtype)
+        self.parts.append(LENGTH.pack(a.size))
+        self.parts.append(a.tobytes())
+
+    def rng(self, rng: np.random.Generator) -> None:
+        state = rng.bit_generator.state
+        if state["bit_generator"] != "PCG64":
+            raise ValueError(f"cannot snapshot {state['bit_generator']}")
+        self.parts.append(
+            PCG64_STATE.pack(
+                state["state"]["state"].to_bytes(16, "little"),
+                state["state"]["inc"].to_bytes(16, "little"),
+                state["has_uint32"],
+                state["uinteger"],
+            )
+        )
+
+    def random(self, r: random.Random) -> None:
+        version, mt, gauss = r.getstate()
+        self.array(mt, "<u4")
+        self.array([np.nan if gauss is None else gauss], "<f8")
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.parts)
+
+
+class SnapshotReader:
+    def __init__(self, data: bytes):
+        if len(data) < HEADER.size:
+            raise ValueError("not a simulator snapshot")
+        magic, version, self.t, self.N, *self.counts = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a simulator snapshot")
+        self.data = memoryview(data)
+        self.offset = HEADER.size
+
+    def array(self, dtype) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        (n,) = LENGTH.unpack_from(self.data, self.offset)
+        self.offset += LENGTH.size
+        a = np.frombuffer(self.data, dtype=dtype, count=n, offset=self.offset).copy()
+        self.offset += n * dtype.itemsize
+        return a
+
+    def rng(self, rng: np.random.Generator) -> None:
+        s, inc, has_uint32, uinteger = PCG64_STATE.unpack_from(self.data, self.offset)
+        self.offset += PCG64_STATE.size
+        rng.bit_generator.state = {
+            "bit_generator": "PCG64",
+            "state": {"state": int.from_bytes(s, "little"), "inc": int.from_bytes(inc, "little")},
+            "has_uint32": has_uint32,
+            "uinteger": uinteger,
+        }
+
+    def random(self, r: random.Random) -> None:
+        mt = tuple(self.array("<u4").tolist())
+        gauss = float(self.array("<f8")[0])
+        r.setstate((3, mt, None if np.isnan(gauss) else gauss))
@@ -0,0 +1,97 @@
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+from .mapf_utils import Coord, Grid
+
+
+class StagingAllocator:
+    # persistent occupancy / reservation bitmaps over flat cell ids, and the
+    # search order around each station (BFS over the whole rectangle, neighbors
+    # up, down, left, right) with static blockers already filtered out
+    def __init__(self, grid: Grid, station_cells: list[Coord], depth: int = 256):
+        self.grid = grid
+        self.height, self.width = grid.shape
+        self.V = grid.size
+        self.depth = depth
+        self.passable = grid.reshape(-1).astype(bool)
+        self.occupied = np.zeros(self.V, dtype=np.int32)  # agents per cell
+        self.reserved = np.zeros(self.V, dtype=bool)  # staging reservations
+        self.candidate = self.passable.copy()  # passable and not a station
+        for y, x in station_cells:
+            self.candidate[y * self.width + x] = False
+        self.orders: dict[int, np.ndarray] = {}
+        self.searches = 0
+        for c in station_cells:
+            self.order(c[0] * self.width + c[1])
+
+    def to_id(self, v: Coord) -> int:
+        return v[0] * self.width + v[1]
+
+    def bfs(self, s: int):
+        H, W = self.height, self.width
+        seen = np.zeros(self.V, dtype=bool)
+        seen[s] = True
+        Q = deque([s])
+        while len(Q) > 0:
+            u = Q.popleft()
+            yield u
+            y, x = divmod(u, W)
+            for ok, v in (
+                (y > 0, u - W),
+                (y + 1 < H, u + W),
+                (x > 0, u - 1),
+                (x + 1 < W, u + 1),
+            ):
+                if ok and not seen[v]:
+                    seen[v] = True
+                    Q.append(v)
+
+    def order(self, s: int) -> np.ndarray:
+        # first depth candidate cells in search order, computed once per target
+        order = self.orders.get(s)
+        if order is None:
+            out = []
+            for u in self.bfs(s):
+                if self.candidate[u]:
+                    out.append(u)
+                    if len(out) >= self.depth:
+                        break
+            order = np.array(out, dtype=np.int64)
+            self.orders[s] = order
+        return order
+
+    def set_positions(self, old: np.ndarray | None, new: np.ndarray) -> None:
+        if old is not None:
+            np.subtract.at(self.occupied, old, 1)
+        np.add.at(self.occupied, new, 1)
+
+    def reset(self, positions: np.ndarray, reserved: np.ndarray) -> None:
+        self.occupied[:] = 0
+        np.add.at(self.occupied, positions, 1)
+        self.reserved[:] = False
+        self.reserved[reserved] = True
+
+    def reserve(self, v: Coord) -> None:
+        self.reserved[self.to_id(v)] = True
+
+    def release(self, v: Coord) -> None:
+        self.reserved[self.to_id(v)] = False
+
+    def find_near(self, target: Coord) -> Optional[Coord]:
+        self.searches += 1
+        order = self.order(self.to_id(target))
+        for k in range(0, len(order), 32):
+            chunk = order[k : k + 32]
+            free = (self.occupied[chunk] == 0) & ~self.reserved[chunk]
+            if free.any():
+                return divmod(int(chunk[np.argmax(free)]), self.width)
+        if len(order) < self.depth:
+            return None  # every candidate cell was in the order
+
+        # rare, the precomputed order is exhausted
+        for u in self.bfs(self.to_id(target)):
+            if self.candidate[u] and self.occupied[u] == 0 and not self.reserved[u]:
+                return divmod(u, self.width)
+        return None
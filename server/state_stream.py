@@ -0,0 +1,204 @@
+import json
+import struct
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+from .destination_bin import DestinationBin
+from .map_reader import Grid
+from .robot import Robot
+
+# bumped whenever static_state, state_patch or the binary frame change shape
+PROTOCOL_VERSION = 2
+
+# binary frame: header, one record per robot in the frame, then UTF-8 JSON
+# with whatever is not a pose (paths, bins, removed robots, robot ids)
+FRAME_MAGIC = b"RBST"
+FRAME_HEADER = struct.Struct("<4sHBxIHxxI")  # magic, version, flags, seq, robots, json bytes
+assert FRAME_HEADER.size == 20
+FLAG_KEYFRAME = 1
+# index into robotIds, grid x/y/rotation, absolute x/y/heading
+ROBOT_RECORD = np.dtype(
+    [
+        ("index", "<i2"),
+        ("x", "<i2"),
+        ("y", "<i2"),
+        ("rotation", "<i2"),
+        ("ax", "<f4"),
+        ("ay", "<f4"),
+        ("heading", "<f4"),
+    ]
+)
+assert ROBOT_RECORD.itemsize == 20
+FORMATS = ("json", "binary")
+
+
+def robot_pose(r: Robot) -> tuple:
+    g, a = r.position.grid, r.position.absolute
+    return (g.x, g.y, int(g.rotation), a.x, a.y, a.rotation_deg)
+
+
+@dataclass
+class Frame:
+    seq: int
+    keyframe: bool
+    robots: list[tuple[str, tuple]]  # (id, pose)
+    paths: dict[str, Optional[list]]  # changed paths only, all in a keyframe
+    bins: dict[int, tuple]  # changed items only, all in a keyframe
+    removed: list[str] = field(default_factory=list)
+    robot_ids: Optional[list[str]] = None  # when the id list grew, and in keyframes
+
+
+class StateStream:
+    # static data (grid, base, bin layout) goes to a client once at connect,
+    # then each tick only the robots and bins that changed since the previous
+    # frame; every keyframe_every frames, and on a client's resync request, a
+    # keyframe with everything. frames carry a sequence number so that a
+    # client can tell it missed one. a frame is computed once per tick and
+    # encoded as JSON or binary for the clients that asked for each
+    def __init__(
+        self,
+        grid: Grid,
+        cell_size_m: float,
+        base_xy: tuple[int, int],
+        robots: dict[str, Robot],
+        bins: list[DestinationBin],
+        keyframe_every: int = 100,
+    ):
+        self.grid = grid
+        self.cell_size_m = cell_size_m
+        self.base_xy = base_xy
+        self.robots = robots
+        self.bins = bins
+        self.keyframe_every = keyframe_every
+        self.seq = 0
+        # robot ids in order of appearance, binary records refer to them by index
+        self.robot_ids: list[str] = []
+        self.robot_index: dict[str, int] = {}
+        # what the last frame said, per robot (pose, path) and per bin (items)
+        self.sent_poses: dict[str, tuple] = {}
+        self.sent_paths: dict[str, Optional[list]] = {}
+        self.sent_items: dict[int, tuple] = {}
+        self.index_robots()
+        self.remember()
+
+    def static_state(self) -> dict:
+        return {
+            "version": PROTOCOL_VERSION,
+            "grid": self.grid,
+            "cellSizeM": self.cell_size_m,
+            "base": {"x": self.base_xy[0], "y": self.base_xy[1]},
+            "destinationBins": [
+                {"id": b.id, "x": b.x, "y": b.y, "capacity": b.capacity} for b in self.bins
+            ],
+            "robotIds": list(self.robot_ids),
+        }
+
+    def index_robots(self) -> bool:
+        grew = False
+        for rid in self.robots:
+            if rid not in self.robot_index:
+                self.robot_index[rid] = len(self.robot_ids)
+                self.robot_ids.append(rid)
+                grew = True
+        return grew
+
+    def keyframe(self) -> Frame:
+        # everything as of the last frame, for the periodic keyframe or a
+        # client that (re)joins; the next patch applies on top of it
+        return Frame(
+            seq=self.seq,
+            keyframe=True,
+            robots=list(self.sent_poses.items()),
+            paths=dict(self.sent_paths),
+            bins=dict(self.sent_items),
+            robot_ids=list(self.robot_ids),
+        )
+
+    def next_frame(self) -> Frame:
+        self.seq += 1
+        grew = self.index_robots()
+        if self.seq % self.keyframe_every == 0:
+            self.remember()
+            return self.keyframe()
+
+        robots = []
+        paths = {}
+        for rid, r in self.robots.items():
+            pose = robot_pose(r)
+            if rid not in self.sent_paths or r.path is not self.sent_paths[rid]:
+                paths[rid] = r.path
+                self.sent_paths[rid] = r.path
+            if rid in paths or pose != self.sent_poses.get(rid):
+                robots.append((rid, pose))
+                self.sent_poses[rid] = pose
+        removed = [rid for rid in self.sent_poses if rid not in self.robots]
+        for rid in removed:
+            del self.sent_poses[rid], self.sent_paths[rid]
+
+        bins = {}
+        for b in self.bins:
+            items = tuple(b.items)
+            if items != self.sent_items.get(b.id):
+                bins[b.id] = items
+                self.sent_items[b.id] = items
+
+        return Frame(
+            self.seq, False, robots, paths, bins, removed, list(self.robot_ids) if grew else None
+        )
+
+    def remember(self) -> None:
+        self.sent_poses = {rid: robot_pose(r) for rid, r in self.robots.items()}
+        self.sent_paths = {rid: r.path for rid, r in self.robots.items()}
+        self.sent_items = {b.id: tuple(b.items) for b in self.bins}
+
+    def to_json(self, frame: Frame) -> dict:
+        robots = []
+        for rid, (x, y, rotation, ax, ay, deg) in frame.robots:
+            entry = {
+                "id": rid,
+                "grid": {"x": x, "y": y, "rotation": rotation},
+                "absolute": {"x": ax, "y": ay, "rotationDeg": deg},
+            }
+            if rid in frame.paths:
+                entry["path"] = frame.paths[rid]
+            robots.append(entry)
+        return {
+            "seq": frame.seq,
+            "keyframe": frame.keyframe,
+            "robots": robots,
+            "destinationBins": [{"id": k, "items": list(items)} for k, items in frame.bins.items()],
+            "removedRobots": frame.removed,
+        }
+
+    def to_binary(self, frame: Frame) -> bytes:
+        records = np.zeros(len(frame.robots), dtype=ROBOT_RECORD)
+        if len(frame.robots) > 0:
+            index = [self.robot_index[rid] for rid, _ in frame.robots]
+            poses = [pose for _, pose in frame.robots]
+            records["index"] = index
+            for name, column in zip(ROBOT_RECORD.names[1:], zip(*poses)):
+                records[name] = column
+        extra = {}
+        if frame.robot_ids is not None:
+            extra["robotIds"] = frame.robot_ids
+        if len(frame.paths) > 0:
+            extra["paths"] = frame.paths
+        if len(frame.bins) > 0:
+            extra["destinationBins"] = [{"id": k, "items": list(items)} for k, items in frame.bins.items()]
+        if len(frame.removed) > 0:
+            extra["removedRobots"] = frame.removed
+        tail = json.dumps(extra, separators=(",", ":")).encode() if extra else b""
+        header = FRAME_HEADER.pack(
+            FRAME_MAGIC,
+            PROTOCOL_VERSION,
+            FLAG_KEYFRAME if frame.keyframe else 0,
+            frame.seq,
+            len(records),
+            len(tail),
+        )
+        return header + records.tobytes() + tail
+
+    def encode(self, frame: Frame, fmt: str):
+        return self.to_binary(frame) if fmt == "binary" else self.to_json(frame)
@@ -0,0 +1,149 @@
+import heapq
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+from .mapf_utils import Coord, Grid
+
+UNREACHED = np.iinfo(np.int32).max
+
+
+class StationIndex:
+    # nearest free station from every cell, as a multi-source BFS (Voronoi)
+    # labeling over free stations; a cell holds (dist, station), ties go to the
+    # lower station index, i.e., the same answer as scanning stations in order
+    def __init__(self, grid: Grid, cells: list[Coord]):
+        self.grid = grid
+        self.height, self.width = grid.shape
+        self.V = grid.size
+        self.passable = grid.reshape(-1).astype(bool)
+        self.cell_ids = [y * self.width + x for (y, x) in cells]
+        self.free = [True] * len(cells)
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        V, W = self.V, self.width
+        self.dist = np.full(V, UNREACHED, dtype=np.int32)
+        self.label = np.full(V, -1, dtype=np.int32)
+
+        # sources, lower index wins on shared cells
+        for k in reversed(range(len(self.cell_ids))):
+            c = self.cell_ids[k]
+            if self.free[k] and self.passable[c]:
+                self.dist[c] = 0
+                self.label[c] = k
+        frontier = np.flatnonzero(self.dist == 0)
+
+        # BFS level by level, keeping the lowest label per newly reached cell
+        level = 0
+        while len(frontier) > 0:
+            level += 1
+            x = frontier % W
+            src = np.concatenate(
+                (
+                    frontier[x > 0],
+                    frontier[x < W - 1],
+                    frontier[frontier >= W],
+                    frontier[frontier < V - W],
+                )
+            )
+            dst = np.concatenate(
+                (
+                    frontier[x > 0] - 1,
+                    frontier[x < W - 1] + 1,
+                    frontier[frontier >= W] - W,
+                    frontier[frontier < V - W] + W,
+                )
+            )
+            ok = self.passable[dst] & (self.dist[dst] == UNREACHED)
+            dst, lab = dst[ok], self.label[src[ok]]
+            order = np.lexsort((lab, dst))
+            dst, lab = dst[order], lab[order]
+            first = np.ones(len(dst), dtype=bool)
+            first[1:] = dst[1:] != dst[:-1]
+            dst, lab = dst[first], lab[first]
+            self.dist[dst] = level
+            self.label[dst] = lab
+            frontier = dst
+
+    def reset(self, free: list[bool]) -> None:
+        self.free = list(free)
+        self.rebuild()
+
+    def neighbors(self, v: int) -> list[int]:
+        W = self.width
+        out = []
+        x = v % W
+        if x > 0 and self.passable[v - 1]:
+            out.append(v - 1)
+        if x < W - 1 and self.passable[v + 1]:
+            out.append(v + 1)
+        if v >= W and self.passable[v - W]:
+            out.append(v - W)
+        if v < self.V - W and self.passable[v + W]:
+            out.append(v + W)
+        return out
+
+    def nearest(self, pos: Coord) -> Optional[int]:
+        k = int(self.label[pos[0] * self.width + pos[1]])
+        if k >= 0:
+            return k
+        # no free station reachable, the first free one as in a linear scan
+        for k, free in enumerate(self.free):
+            if free:
+                return k
+        return None
+
+    def claim(self, k: int) -> None:
+        # station k is taken: relabel its region from the surrounding cells
+        if not self.free[k]:
+            return
+        self.free[k] = False
+        region = np.flatnonzero(self.label == k)
+        self.dist[region] = UNREACHED
+        self.label[region] = -1
+
+        heap: list[tuple[int, int, int]] = []
+        for j, c in enumerate(self.cell_ids):
+            if self.free[j] and self.passable[c] and self.label[c] < 0:
+                self.dist[c] = 0
+                self.label[c] = j
+        for u in region.tolist():
+            if self.label[u] >= 0:
+                heap.append((0, int(self.label[u]), u))
+            for v in self.neighbors(u):
+                if self.label[v] >= 0:
+                    heap.append((int(self.dist[v]), int(self.label[v]), v))
+        heapq.heapify(heap)
+
+        # Dijkstra on (dist, label), only cells of the region can improve
+        while len(heap) > 0:
+            d, lab, u = heapq.heappop(heap)
+            if (d, lab) != (self.dist[u], self.label[u]):
+                continue
+            for v in self.neighbors(u):
+                if (d + 1, lab) < (self.dist[v], self.label[v]):
+                    self.dist[v] = d + 1
+                    self.label[v] = lab
+                    heapq.heappush(heap, (d + 1, lab, v))
+
+    def release(self, k: int) -> None:
+        # station k is free again: grow its region while it improves labels
+        if self.free[k]:
+            return
+        self.free[k] = True
+        c = self.cell_ids[k]
+        if not self.passable[c] or (self.dist[c], self.label[c]) <= (0, k):
+            return
+        self.dist[c] = 0
+        self.label[c] = k
+        Q = deque([c])
+        while len(Q) > 0:
+            u = Q.popleft()
+            d = int(self.dist[u]) + 1
+            for v in self.neighbors(u):
+                if (d, k) < (self.dist[v], self.label[v]):
+                    self.dist[v] = d
+                    self.label[v] = k
+                    Q.append(v)
@@ -0,0 +1,114 @@
+import numpy as np
+
+from .grid_graph import neighbor_table
+from .mapf_utils import Config, Configs, Grid
+
+
+class MAPFViolation(Exception):
+    def __init__(self, kind: str, t: int, agents: tuple[int, ...]):
+        self.kind = kind
+        self.t = t
+        self.agents = agents
+        super().__init__(f"invalid solution, {kind} at t={t}, agents {agents}")
+
+
+def configs_to_ids(grid: Grid, configs: Configs) -> np.ndarray:
+    # (T, N) array of flat cell ids, v = y * width + x
+    yx = np.asarray(configs, dtype=np.int64).reshape(len(configs), -1, 2)
+    return yx[..., 0] * grid.shape[1] + yx[..., 1]
+
+
+def validate_plan(
+    grid: Grid,
+    starts: np.ndarray,
+    goals: np.ndarray,
+    plan: np.ndarray,
+) -> None:
+    # vectorized counterpart of mapf_utils.validate_mapf_solution on flat ids;
+    # raises MAPFViolation for the earliest violation, ties go to starts,
+    # then out of grid, continuity, vertex collision, edge collision, goals
+    plan = np.asarray(plan, dtype=np.int64)
+    if plan.ndim != 2 or plan.shape[0] == 0:
+        raise MAPFViolation("empty solution", 0, ())
+    T, N = plan.shape
+    V = grid.size
+    found: list[tuple[int, int, str, tuple[int, ...]]] = []
+
+    # starts & goals
+    bad = np.flatnonzero(plan[0] != starts)
+    if len(bad) > 0:
+        found.append((0, 0, "starts", (int(bad[0]),)))
+    bad = np.flatnonzero(plan[-1] != goals)
+    if len(bad) > 0:
+        found.append((T - 1, 5, "goals", (int(bad[0]),)))
+
+    # vertices on the grid; the checks below index tables by vertex, so
+    # they only look at the timesteps before the first one off the grid
+    bad = np.argwhere((plan < 0) | (plan >= V))
+    if len(bad) > 0:
+        t, i = bad[0]
+        found.append((int(t), 1, "out of grid", (int(i),)))
+        plan = plan[:t]
+
+    pre, now = plan[:-1], plan[1:]
+
+    # connectivity, by the neighbor lookup table
+    table = neighbor_table(grid)
+    ok = (now == pre) | (table[pre] == now[..., None]).any(axis=-1)
+    bad = np.argwhere(~ok)
+    if len(bad) > 0:
+        t, i = bad[0]
+        found.append((int(t) + 1, 2, "connectivity", (int(i),)))
+
+    # vertex collision, by per-row uniqueness
+    order = np.argsort(plan, axis=1, kind="stable")
+    srt = np.take_along_axis(plan, order, axis=1)
+    bad = np.argwhere(srt[:, 1:] == srt[:, :-1])
+    if len(bad) > 0:
+        t, k = bad[0]
+        agents = tuple(sorted((int(order[t, k]), int(order[t, k + 1]))))
+        found.append((int(t), 3, "vertex collision", agents))
+
+    # edge collision, by duplicate unordered (from, to) keys among moving agents
+    moving = np.argwhere(pre != now)
+    if len(moving) > 0:
+        t, i = moving[:, 0], moving[:, 1]
+        u, v = pre[t, i], now[t, i]
+        keys = (t * V + np.minimum(u, v)) * V + np.maximum(u, v)
+        order = np.argsort(keys, kind="stable")
+        dup = np.flatnonzero(keys[order][1:] == keys[order][:-1])
+        if len(dup) > 0:
+            a, b = order[dup[0]], order[dup[0] + 1]
+            agents = tuple(sorted((int(i[a]), int(i[b]))))
+            found.append((int(t[a]) + 1, 4, "edge collision", agents))
+
+    if len(found) > 0:
+        t, _, kind, agents = min(found)
+        raise MAPFViolation(kind, t, agents)
+
+
+def validate_mapf_solution_fast(
+    grid: Grid,
+    starts: Config,
+    goals: Config,
+    solution: Configs,
+) -> None:
+    plan = configs_to_ids(grid, solution)
+    W = grid.shape[1]
+    starts_ids = np.array([y * W + x for (y, x) in starts], dtype=np.int64)
+    goals_ids = np.array([y * W + x for (y, x) in goals], dtype=np.int64)
+    validate_plan(grid, starts_ids, goals_ids, plan)
+
+
+def is_valid_plan(
+    grid: Grid,
+    starts: np.ndarray,
+    goals: np.ndarray,
+    plan: np.ndarray,
+) -> bool:
+    try:
+        validate_plan(grid, starts, goals, plan)
+        return True
+    except MAPFViolation as e:
+        print(e)
+        return False
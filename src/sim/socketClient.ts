@@ -18,25 +18,172 @@ export type GameState = {
   }[]
 }
 
+export type RobotState = GameState["robots"][number]
+export type BinLayout = Omit<GameState["destinationBins"][number], "items">
+
+// must match PROTOCOL_VERSION in server/state_stream.py
+export const PROTOCOL_VERSION = 2
+
+// JSON state_patch events (default) or binary state_frame, chosen at connect
+export type FrameFormat = "json" | "binary"
+
+// sent once at connect
+export type StaticState = {
+  version: number
+  grid: GameState["grid"]
+  cellSizeM: number
+  base: { x: number; y: number }
+  destinationBins: BinLayout[]
+  robotIds: string[]
+  format: FrameFormat
+  session: string
+}
+
+// robots and bins that changed since frame seq - 1; a keyframe has all of
+// them and replaces what the client has. path is left out when unchanged
+export type StatePatch = {
+  seq: number
+  keyframe: boolean
+  robots: (Omit<RobotState, "path"> & { path?: Path | null })[]
+  destinationBins: { id: number; items: unknown[] }[]
+  removedRobots: string[]
+}
+
+// binary state_frame layout, see server/state_stream.py: a 20-byte header
+// (magic "RBST", u16 version, u8 flags, pad, u32 seq, u16 robots, pad,
+// u32 JSON bytes), 20-byte robot records (i16 index into robotIds, i16 grid
+// x/y/rotation, f32 absolute x/y/heading), then UTF-8 JSON with robotIds,
+// paths, destinationBins and removedRobots when present
+const FRAME_HEADER_BYTES = 20
+const ROBOT_RECORD_BYTES = 20
+const FLAG_KEYFRAME = 1
+const utf8 = new TextDecoder()
+
 let socket: Socket | null = null
+let staticState: StaticState | null = null
+let robotIds: string[] = []
+let lastSeq: number | null = null
+let resyncing = false
+const robots = new Map<string, RobotState>()
+const binItems = new Map<number, unknown[]>()
 
 type Listener = (s: GameState) => void
 const listeners = new Set<Listener>()
 
-export function ensureSocket() {
+export function ensureSocket(format: FrameFormat = "json", session = "default") {
   if (socket) return socket
-  socket = io("http://localhost:8000", { transports: ["websocket"] })
-  socket.on("game_state", (s: GameState) => {
-    listeners.forEach(fn => fn(s))
+  socket = io("http://localhost:8000", { transports: ["websocket"], auth: { format, session } })
+  socket.on("static_state", (s: StaticState) => {
+    if (s.version !== PROTOCOL_VERSION) {
+      console.warn(`server protocol ${s.version}, client ${PROTOCOL_VERSION}`)
+    }
+    staticState = s
+    robotIds = s.robotIds
+    lastSeq = null
   })
+  socket.on("session_closed", () => {
+    staticState = null
+    lastSeq = null
+    robots.clear()
+    binItems.clear()
+  })
+  socket.on("state_patch", onPatch)
+  socket.on("state_frame", (data: ArrayBuffer) => onPatch(decodeFrame(data)))
   return socket
 }
 
+function decodeFrame(data: ArrayBuffer): StatePatch {
+  const view = new DataView(data)
+  const flags = view.getUint8(6)
+  const seq = view.getUint32(8, true)
+  const n = view.getUint16(12, true)
+  const jsonBytes = view.getUint32(16, true)
+  const tailAt = FRAME_HEADER_BYTES + n * ROBOT_RECORD_BYTES
+  const extra = jsonBytes > 0 ? JSON.parse(utf8.decode(new Uint8Array(data, tailAt, jsonBytes))) : {}
+  if (extra.robotIds) robotIds = extra.robotIds
+  const paths: Record<string, Path | null> = extra.paths ?? {}
+  const robots: StatePatch["robots"] = []
+  for (let k = 0; k < n; k++) {
+    const o = FRAME_HEADER_BYTES + k * ROBOT_RECORD_BYTES
+    const id = robotIds[view.getInt16(o, true)]
+    robots.push({
+      id,
+      grid: { x: view.getInt16(o + 2, true), y: view.getInt16(o + 4, true), rotation: view.getInt16(o + 6, true) },
+      absolute: {
+        x: view.getFloat32(o + 8, true),
+        y: view.getFloat32(o + 12, true),
+        rotationDeg: view.getFloat32(o + 16, true),
+      },
+      ...(id in paths ? { path: paths[id] } : {}),
+    })
+  }
+  return {
+    seq,
+    keyframe: (flags & FLAG_KEYFRAME) !== 0,
+    robots,
+    destinationBins: extra.destinationBins ?? [],
+    removedRobots: extra.removedRobots ?? [],
+  }
+}
+
+function onPatch(p: StatePatch) {
+  if (!p.keyframe && (lastSeq === null || p.seq !== lastSeq + 1)) {
+    // missed a frame, ask once for a keyframe
+    if (!resyncing) socket!.emit("resync")
+    resyncing = true
+    return
+  }
+  resyncing = false
+  applyPatch(p)
+  const s = currentState()
+  if (s) listeners.forEach(fn => fn(s))
+}
+
+function applyPatch(p: StatePatch) {
+  if (p.keyframe) {
+    robots.clear()
+    binItems.clear()
+  }
+  for (const r of p.robots) {
+    const prev = robots.get(r.id)
+    robots.set(r.id, { ...r, path: r.path !== undefined ? r.path : prev?.path ?? null })
+  }
+  for (const id of p.removedRobots) robots.delete(id)
+  for (const b of p.destinationBins) binItems.set(b.id, b.items)
+  lastSeq = p.seq
+}
+
+function currentState(): GameState | null {
+  if (!staticState) return null
+  return {
+    grid: staticState.grid,
+    cellSizeM: staticState.cellSizeM,
+    base: staticState.base,
+    destinationBins: staticState.destinationBins.map(b => ({ ...b, items: binItems.get(b.id) ?? [] })),
+    robots: Array.from(robots.values()),
+  }
+}
+
 export function onState(cb: Listener) {
   listeners.add(cb)
   return () => listeners.delete(cb)
 }
 
+type SessionReply = { id?: string; error?: string }
+
+// sessions: settings as SessionConfig in server/sessions.py, e.g. { map, robots, bins, worker }
+export function createSession(settings: Record<string, unknown> = {}): Promise<SessionReply> {
+  return ensureSocket().emitWithAck("create_session", settings)
+}
+
+export function joinSession(id: string): Promise<SessionReply> {
+  return ensureSocket().emitWithAck("join_session", { id })
+}
+
+export function destroySession(id: string): Promise<SessionReply> {
+  return ensureSocket().emitWithAck("destroy_session", { id })
+}
+
 export function sendMoveTo(x: number, y: number, id = "r1") {
   if (!socket) ensureSocket()
   socket!.emit("move_to", { id, x, y })
@@ -65,3 +65,29 @@ export function parseSolution(text: string): Solution {
       return linePoses;
     });
 }
+
+// binary plan written by server/plan_io.py: 32-byte little-endian header
+// (magic "MAPFPLN\0", version u16, itemsize u16, N u32, T u32, height u32, width u32)
+// followed by a (T, N) array of flat cell ids y * width + x
+export function parseBinarySolution(buffer: ArrayBuffer): Solution {
+  const view = new DataView(buffer);
+  const magic = new TextDecoder().decode(new Uint8Array(buffer, 0, 8));
+  if (magic !== "MAPFPLN\0") throw new Error("Invalid binary solution");
+  const itemsize = view.getUint16(10, true);
+  const n = view.getUint32(12, true);
+  const width = view.getUint32(24, true);
+  const t = n > 0 ? Math.floor((buffer.byteLength - 32) / (n * itemsize)) : 0;
+  const ids = itemsize === 2
+    ? new Int16Array(buffer.slice(32, 32 + t * n * 2))
+    : new Int32Array(buffer.slice(32, 32 + t * n * 4));
+  const solution: Solution = [];
+  for (let step = 0; step < t; step++) {
+    const linePoses: Pose[] = [];
+    for (let agent = 0; agent < n; agent++) {
+      const id = ids[step * n + agent]!;
+      linePoses.push(new Pose(new Coordinate(id % width, Math.floor(id / width))));
+    }
+    solution.push(linePoses);
+  }
+  return solution;
+}
@@ -1,5 +1,5 @@
 import { MapClass } from "./MapClass";
-import { parseSolution, Solution } from "./Solution";
+import { parseBinarySolution, parseSolution, Solution } from "./Solution";
 
 export async function readMap(): Promise<MapClass> {
   // const mapFileResponse = await fetch('/maps/2x2.map');
@@ -15,4 +15,9 @@ export async function readSolution(): Promise<Solution> {
   const demoFileResponse = await fetch('/solutions/sorter-20x14.txt');
   const demoFileContent = await demoFileResponse.text();
   return parseSolution(demoFileContent)
+}
+
+export async function readBinarySolution(url: string): Promise<Solution> {
+  const planFileResponse = await fetch(url);
+  return parseBinarySolution(await planFileResponse.arrayBuffer())
 }
\ No newline at end of file